@@ -18,10 +18,12 @@ from markdown.treeprocessors import Treeprocessor
 import pybtex.backends.html     # type: ignore
 import pybtex.database          # type: ignore
 import pybtex.plugin            # type: ignore
+import pybtex.style             # type: ignore
 import pybtex.style.formatting  # type: ignore
 
 import lxml.html
 
+import hashlib
 import io
 import os.path
 import re
@@ -65,10 +67,16 @@ _CITE_ATTR = 'la-cite-b45be3e01f92cfad8895fc09a1dddc91'
 # However, I feel it's best to emulate Pandoc/RMarkdown for this purpose.)
 
 
+# Note: in both regexes below, the lookbehind assertions come _after_ the literal '@' or '[', even
+# though they constrain the preceding character. Starting with a literal lets the regex engine
+# skip quickly through text containing no candidate characters, which matters because these are
+# searched across whole paragraphs.
+
 CITE_REGEX = r'''
-    (?<! \w ) # Require '@' to come after a non-word character, so as to avoid matching
-              # things like me@example.com.
-    @(
+    @
+    (?<! \w@ ) # Require '@' to come after a non-word character, so as to avoid matching
+               # things like me@example.com.
+    (
         (?P<simple_key> [a-zA-Z0-9_]+ ( [:.#$%&+?<>~/-] [a-zA-Z0-9_]+ )* )
         |
         \{ (?P<complex_key> [^{}]* ( \{ [^{}]* \} )* ) \}
@@ -77,9 +85,9 @@ CITE_REGEX = r'''
 '''
 
 GROUP_REGEX = fr'''(?x)
-    (?<! ! ) # The preceding character must not be '!', to avoid conflicts with the syntax for
-             # embedding images.
     \[
+    (?<! !\[ ) # The preceding character must not be '!', to avoid conflicts with the syntax for
+               # embedding images.
     (?P<pre> [^]@]* )
     (?P<main> ({CITE_REGEX})+)
     \]
@@ -104,16 +112,29 @@ class MetadataPreprocessor(Preprocessor):
         self.bib_parser = bib_parser
         self.cited_keys = cited_keys
 
+        # Keys of entries added from the document's own 'bibliography' files, which must be
+        # removed again if the Markdown instance is reused for another document.
+        self.meta_keys: set[str] = set()
+
+    def reset(self):
+        for key in self.meta_keys:
+            del self.bib_parser.data.entries[key]
+        self.meta_keys.clear()
+
     def run(self, lines):
         meta = self.md.__dict__.get('Meta', {})
         progress = self.ext.getConfig('progress')
 
-        for filename in meta.get('bibliography', []):
-            self.ext.getConfig('live_update_deps').add(filename)
-            try:
-                self.bib_parser.parse_file(filename)
-            except Exception as e:
-                progress.error(NAME, exception = e)
+        if bib_files := meta.get('bibliography', []):
+            existing_keys = set(self.bib_parser.data.entries.keys())
+            for filename in bib_files:
+                self.ext.getConfig('live_update_deps').add(filename)
+                try:
+                    self.bib_parser.parse_file(filename)
+                except Exception as e:
+                    progress.error(NAME, exception = e)
+
+            self.meta_keys.update(set(self.bib_parser.data.entries.keys()) - existing_keys)
 
         for nocite in meta.get('nocite', []):
             if '@*' in nocite:
@@ -187,12 +208,50 @@ class ModifiedPybtexHtmlBackend(pybtex.backends.html.Backend):
         # this HTML (the reference) with its corresponding citations.
 
 
+# Formatted references, shared across documents and Markdown instances (and hence across live-update
+# recompiles, each of which uses a new Markdown instance). See format_bibliography().
+_formatted_entries: dict[tuple, pybtex.style.FormattedEntry] = {}
+FORMATTED_ENTRIES_MAX = 4096
+
+
+def format_bibliography(bib_style: pybtex.style.formatting.BaseStyle,
+                        style_config: tuple,
+                        bib_data: pybtex.database.BibliographyData,
+                        cited_keys: list[str]) -> pybtex.style.FormattedBibliography:
+    '''
+    Equivalent to bib_style.format_bibliography(bib_data, cited_keys), except that formatted
+    entries are memoised. A cached entry is keyed on the style configuration, its label and key,
+    and a digest of the entry's type, fields and persons, so any change to the reference data means
+    it is formatted afresh.
+    '''
+    citations = bib_data.add_extra_citations(cited_keys, bib_style.min_crossrefs)
+    entries = bib_style.sort([bib_data.entries[key] for key in citations])
+    formatted_entries = []
+
+    for label, entry in zip(bib_style.format_labels(entries), entries):
+        entry_digest = hashlib.sha256(repr(entry).encode('utf-8')).digest()
+        key = (style_config, label, entry.key, entry_digest)
+        formatted = _formatted_entries.get(key)
+        if formatted is None:
+            formatted = bib_style.format_entry(label, entry)
+            if len(_formatted_entries) >= FORMATTED_ENTRIES_MAX:
+                # Evict the oldest entry.
+                del _formatted_entries[next(iter(_formatted_entries))]
+            _formatted_entries[key] = formatted
+        formatted_entries.append(formatted)
+
+    return pybtex.style.FormattedBibliography(formatted_entries,
+                                              style = bib_style,
+                                              preamble = bib_data.preamble)
+
+
 class PybtexTreeProcessor(Treeprocessor):
     def __init__(self,
                  md,
                  ext: 'CiteExtension',
                  bib_parser,
                  bib_style: pybtex.style.formatting.BaseStyle,
+                 style_config: tuple,
                  cited_keys: list[str]):
         super().__init__(md)
         self.ext = ext
@@ -203,6 +262,7 @@ class PybtexTreeProcessor(Treeprocessor):
         self.bib_parser = bib_parser
 
         self.bib_style = bib_style
+        self.style_config = style_config
 
         # 'cited_keys' will be empty at first, but in between here and run() below,
         # CitationInlineProcessor will add all citations found in the document.
@@ -217,8 +277,10 @@ class PybtexTreeProcessor(Treeprocessor):
             return
 
         try:
-            formatted_biblio = self.bib_style.format_bibliography(self.bib_parser.data,
-                                                                  self.cited_keys)
+            formatted_biblio = format_bibliography(self.bib_style,
+                                                   self.style_config,
+                                                   self.bib_parser.data,
+                                                   self.cited_keys)
         except pybtex.exceptions.PybtexError as e:
             progress.error(NAME, exception = e)
             return
@@ -434,9 +496,19 @@ class CiteExtension(markdown.Extension):
             ]
         }
         super().__init__(**kwargs)
+        self._cited_keys: list[str] = []
+        self._pre_proc: MetadataPreprocessor | None = None
+
+
+    def reset(self):
+        # Allow the Markdown instance to be reused for another document.
+        self._cited_keys.clear()
+        if self._pre_proc is not None:
+            self._pre_proc.reset()
 
 
     def extendMarkdown(self, md):
+        md.registerExtension(self)
 
         file_spec = self.getConfig('file')
         files: list[str | IO[str]]
@@ -473,6 +545,9 @@ class CiteExtension(markdown.Extension):
                 self.getConfig('progress').error(NAME, exception = e)
 
         # Pybtex formatter -- creates the document reference list.
+        style_config = tuple(self.getConfig(name) for name in ['style', 'label_style', 'name_style',
+                                                               'sorting_style', 'abbreviate_names',
+                                                               'min_crossrefs'])
         bib_style_cls = pybtex.plugin.find_plugin('pybtex.style.formatting',
                                                   self.getConfig('style'))
         bib_style = bib_style_cls(
@@ -483,12 +558,12 @@ class CiteExtension(markdown.Extension):
             min_crossrefs    = self.getConfig('min_crossrefs')
         )
 
-        cited_keys: list[str] = []
+        cited_keys = self._cited_keys
 
         # The pre-processor handles additional directives given in the document metadata. Since
         # it's another extension's preprocessor ('meta') that _parses_ the metadata, our
         # preprocessor must run with a lower priority (than 27).
-        pre_proc = MetadataPreprocessor(md, self, bib_parser, cited_keys)
+        pre_proc = self._pre_proc = MetadataPreprocessor(md, self, bib_parser, cited_keys)
         md.preprocessors.register(pre_proc, 'la-cite-pre', -10)
 
         # The inline processor identifies citations, creates tree nodes to keep track of them
@@ -499,7 +574,7 @@ class CiteExtension(markdown.Extension):
         # The tree processor must run _after_ the inline processor. Python-Markdown runs all inline
         # processors from within a TreeProcessor named InlineProcessor, with priority 20, so
         # PybtexTreeProcessor must have lower priority than that.
-        tree_proc = PybtexTreeProcessor(md, self, bib_parser, bib_style, cited_keys)
+        tree_proc = PybtexTreeProcessor(md, self, bib_parser, bib_style, style_config, cited_keys)
         md.treeprocessors.register(tree_proc, 'la-cite-tree', 10)
 
 
@@ -53,7 +53,7 @@ EVAL_REGEX = r'\$(?P<bt>`+)(?P<code>.*?)(?P=bt)'
 
 class EvalReplacementProcessor(replacement_patterns.ReplacementPattern):
     def __init__(self, progress, replace, allow_exec, env):
-        super().__init__(EVAL_REGEX)
+        super().__init__(EVAL_REGEX, start_chars = '$')
         self.progress = progress
         self.replace = replace
         self.allow_exec = allow_exec
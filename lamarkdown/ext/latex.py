@@ -45,9 +45,8 @@ from .util import replacement_patterns
 
 import markdown
 
-import latex2mathml.converter
-
 import base64
+import concurrent.futures
 import copy
 import hashlib
 import io
@@ -68,6 +67,13 @@ MATH_MATHML = 'mathml'
 MATH_LATEX  = 'latex'
 MATH_IGNORE = 'ignore'
 
+# Snippets may be compiled on worker threads, which all add to the (shared) live-update
+# dependency set.
+DEPS_LOCK = threading.Lock()
+
+# Guards the creation and shutdown of each LatexCompiler's worker threads.
+EXECUTOR_LOCK = threading.Lock()
+
 
 class CommandException(Exception):
     def __init__(self, msg: str, output: str):
@@ -184,6 +190,19 @@ def _pdf2svg_correction(svg: str) -> str:
         svg)
 
 
+def _file_signature(path: str) -> tuple[int, int] | None:
+    '''
+    Returns a cheap signature, for detecting changes to a dependency file, without reading it: its
+    modification time (in nanoseconds, since float seconds can miss rapid re-writes) and size. If
+    the file doesn't exist, returns None.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
 class LatexCompiler:
     '''
     Compiles Latex code identified by the preprocessor/replacement processor, converts it to SVG,
@@ -212,19 +231,25 @@ class LatexCompiler:
 
     def __init__(self, md, cache_factors: tuple, build_dir: str, cache, progress: Progress,
                  live_update_deps: set[str], tex: str, pdf_svg_converter: str, embedding: str,
-                 strip_html_comments: bool, timeout: int, verbose_errors: bool):
+                 strip_html_comments: bool, timeout: int, verbose_errors: bool, workers: int,
+                 base_dir: str = ''):
 
         self._md = md
         self._cache_factors = cache_factors
 
         self._html: dict[int, str] = {}
         self._instance = 0
+        self._pending: dict[int, tuple[concurrent.futures.Future, dict[str, str]]] = {}
+        self._futures: dict[tuple, concurrent.futures.Future] = {}
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._running = 0
 
         self.md = md
         self.build_dir = build_dir
         self.cache = cache
         self.progress = progress
         self.live_update_deps = live_update_deps
+        self._base_dir = base_dir
 
         self.tex_cmdline: str | list[str] = (
             self.TEX_CMDLINES.get(tex)
@@ -245,9 +270,10 @@ class LatexCompiler:
         self.strip_html_comments = strip_html_comments
         self.timeout = timeout
         self.verbose_errors = verbose_errors
+        self.workers = workers
 
 
-    def _generate_html(self, latex: str, attr: dict[str, str]) -> str:
+    def _prepare_latex(self, latex: str) -> tuple[str, tuple]:
         # Run Python Markdown's postprocessors.
 
         # This is important, because Markdown's _pre_processors replace certain constructs,
@@ -266,18 +292,31 @@ class LatexCompiler:
         if self.strip_html_comments:
             latex = HTML_COMMENT_RE.sub('', latex)
 
-        # Build a representation of all the input information sources.
-        cache_key = (self.CACHE_PREFIX, latex, self._cache_factors)
+        # Build a representation of all the input information sources. We key the cache on a
+        # digest of these, rather than the Latex code itself, so that the (on-disk) cache need not
+        # store and compare potentially-large strings.
+        cache_key = (
+            self.CACHE_PREFIX,
+            hashlib.sha256(repr((latex, self._cache_factors)).encode('utf-8')).hexdigest()
+        )
+        return latex, cache_key
+
+
+    def _build_element(self, latex: str, cache_key: tuple) -> ElementTree.Element | str:
+        '''
+        Retrieves or generates the SVG representation of the given Latex code. This returns either
+        an element (to which attributes are yet to be assigned), or an HTML error message string.
+
+        This may be called from a worker thread, in parallel with other instances of itself.
+        '''
 
         # If not in cache, compile it.
         run_latex = True
         if cache_key in self.cache:
-            element, dependencies = self.cache.get(cache_key)
+            svg_content, dependencies = self.cache.get(cache_key)
             if self.are_deps_unchanged(dependencies):
-                self.live_update_deps.update(dependencies)
-                # We make a copy of the cached element, because different instances of it could
-                # conceivably be assigned different attributes below.
-                element = copy.copy(element)
+                with DEPS_LOCK:
+                    self.live_update_deps.update(dependencies)
                 run_latex = False
             else:
                 self.progress.cache_hit(NAME)
@@ -308,7 +347,7 @@ class LatexCompiler:
                     self.tex_cmdline,
                     pdf_file,
                     cwd = file_build_dir,
-                    env = {**os.environ, 'TEXINPUTS': f'.:{os.getcwd()}:'},
+                    env = {**os.environ, 'TEXINPUTS': f'.:{self.base_dir}:'},
                     timeout = self.timeout
                 )
             except CommandException as e:
@@ -342,7 +381,8 @@ class LatexCompiler:
 
             if os.path.exists(fls_file):
                 dependencies = self.find_live_update_deps(fls_file)
-                self.live_update_deps.update(dependencies.keys())
+                with DEPS_LOCK:
+                    self.live_update_deps.update(dependencies.keys())
             else:
                 dependencies = {}
                 self.progress.warning(NAME, msg = 'Tex command did not create an .fls file')
@@ -359,25 +399,16 @@ class LatexCompiler:
 
                 with open(svg_file) as reader:
                     svg_content = self.converter_correction(reader.read())
-                    element = ElementTree.fromstring(svg_content)
-                    util.strip_namespaces(element)
-                    util.opaque_tree(element)
-
-                    if element.get('viewBox') in [None, '0 0 0 0']:
-                        return self.progress.error(
-                            NAME,
-                            msg = (f'Resulting SVG code is empty -- either {self.tex_cmdline[0]} '
-                                   f'or {self.converter_cmdline[0]} failed'),
-                            output = svg_content).as_html_str()
-
-                if self.embedding == DATA_URI_EMBEDDING:
-                    data = base64.b64encode(svg_content.strip().encode()).decode()
-                    # data_uri = f'data:image/svg+xml;base64,{data}'
-                    # element = ElementTree.fromstring(f'<img src="{data_uri}" />')
-                    element = ElementTree.fromstring(
-                        f'<img src="data:image/svg+xml;base64,{data}" />')
-
-                self.cache[cache_key] = (copy.copy(element), dependencies)
+
+                if ElementTree.fromstring(svg_content).get('viewBox') in [None, '0 0 0 0']:
+                    return self.progress.error(
+                        NAME,
+                        msg = (f'Resulting SVG code is empty -- either {self.tex_cmdline[0]} '
+                               f'or {self.converter_cmdline[0]} failed'),
+                        output = svg_content).as_html_str()
+
+                # We cache the SVG code itself, independent of the embedding.
+                self.cache[cache_key] = (svg_content, dependencies)
 
             except CommandException as e:
                 return self.progress.error(NAME,
@@ -387,38 +418,124 @@ class LatexCompiler:
                                            code = latex,
                                            context_lines = None).as_html_str()
 
-        util.set_attributes(element, attr)
-        return ElementTree.tostring(element, encoding = 'unicode')
+        return self._embed(svg_content)
+
+
+    def _embed(self, svg_content: str) -> ElementTree.Element:
+        '''
+        Creates the element representing the given SVG code in the HTML document, according to the
+        'embedding' option.
+        '''
+        if self.embedding == DATA_URI_EMBEDDING:
+            data = base64.b64encode(svg_content.strip().encode()).decode()
+            return ElementTree.fromstring(f'<img src="data:image/svg+xml;base64,{data}" />')
+
+        element = ElementTree.fromstring(svg_content)
+        util.strip_namespaces(element)
+        util.opaque_tree(element)
+        return element
+
 
+    @property
+    def base_dir(self) -> str:
+        return os.path.abspath(self._base_dir or os.getcwd())
 
     def find_live_update_deps(self, fls_file):
-        cwd = os.getcwd()
+        base_dir = self.base_dir
         with open(fls_file) as log:
             input_files = {os.path.abspath(line[6:-1] if line.endswith('\n') else line[6:])
                            for line in log
                            if line.startswith('INPUT ')}
 
             return {
-                f: os.stat(f).st_mtime if os.path.exists(f) else None
+                f: _file_signature(f)
                 for f in input_files
                 if (os.path.commonpath([self.home_dir, f]) == self.home_dir
-                    or os.path.commonpath([cwd, f]) == cwd)
+                    or os.path.commonpath([base_dir, f]) == base_dir)
             }
 
     def are_deps_unchanged(self, dependencies):
-        for f, old_mtime in dependencies.items():
-            if old_mtime != (os.stat(f).st_mtime if os.path.exists(f) else None):
+        for f, old_signature in dependencies.items():
+            if old_signature != _file_signature(f):
                 return False  # Changed
         return True  # Unchanged
 
 
+    def reset(self):
+        # Discard the HTML for the previous document, so the Markdown instance can be reused.
+        self._resolve()
+        self._html.clear()
+        self._instance = 0
+
+
     def compile(self, full_doc: str, attr: dict[str, str]):
+        '''
+        Starts compiling a Latex snippet, and returns a placeholder string to be substituted (by
+        the postprocessor) with the resulting HTML.
+
+        Tex and its PDF-to-SVG converter have significant start-up costs, so (if 'workers' > 1) we
+        run separate snippets in parallel, waiting for them only once the HTML is needed.
+        '''
         self._instance += 1
-        self._html[self._instance] = self._generate_html(full_doc, attr)
+        latex, cache_key = self._prepare_latex(full_doc)
+
+        # Identical snippets share the same compilation.
+        future = self._futures.get(cache_key)
+        if future is None:
+            if self.workers > 1:
+                with EXECUTOR_LOCK:
+                    if self._executor is None:
+                        self._executor = concurrent.futures.ThreadPoolExecutor(
+                            max_workers = self.workers,
+                            thread_name_prefix = NAME)
+                    self._running += 1
+                    future = self._executor.submit(self._build_element, latex, cache_key)
+
+                # (Outside the lock, since the callback runs immediately if the future is already
+                # done.)
+                future.add_done_callback(self._build_done)
+
+            else:
+                future = concurrent.futures.Future()
+                future.set_result(self._build_element(latex, cache_key))
+
+            self._futures[cache_key] = future
+
+        self._pending[self._instance] = (future, attr)
         return f'{LATEX_PLACEHOLDER_PREFIX}{self._instance}{ETX}'
 
+
+    def _build_done(self, _future: concurrent.futures.Future):
+        # Shut down the worker threads as soon as they have nothing left to compile, rather than
+        # when the HTML is requested, which never happens if (say) another extension fails first.
+        # Any later snippet will start a new executor.
+        with EXECUTOR_LOCK:
+            self._running -= 1
+            if self._running == 0 and self._executor is not None:
+                self._executor.shutdown(wait = False)
+                self._executor = None
+
+
+    def _resolve(self):
+        for instance, (future, attr) in self._pending.items():
+            element = future.result()
+            if isinstance(element, str):
+                self._html[instance] = element  # An error message
+            else:
+                # We make a copy of the element, because different instances of it could
+                # conceivably be assigned different attributes.
+                element = copy.copy(element)
+                util.set_attributes(element, attr)
+                self._html[instance] = ElementTree.tostring(element, encoding = 'unicode')
+
+        self._pending.clear()
+        self._futures.clear()
+
+
     @property
     def html(self):
+        if self._pending:
+            self._resolve()
         return self._html
 
 
@@ -586,7 +703,38 @@ MATH_TEX_RE = rf'''(?xs)
 '''
 
 
-class LatexReplacementProcessor(replacement_patterns.ReplacementPattern):
+class MathReplacementPattern(replacement_patterns.ReplacementPattern):
+    '''
+    Common base for the math replacement processors. A forward scan over the text locates and
+    validates the $...$ / $$...$$ delimiters first, so that MATH_TEX_RE itself only runs (to
+    extract the groups) where a match is already known to exist. Stray, unclosed or whitespace-
+    padded '$' characters are thus rejected without engaging the regex engine.
+    '''
+
+    def __init__(self):
+        super().__init__(MATH_TEX_RE, start_chars = '$')
+
+    def match(self, text: str, pos: int) -> re.Match | None:
+        if text[pos] != '$':
+            return None
+
+        if text.startswith('$$', pos):
+            # Block math: one or more non-'$' characters, closed by '$$'.
+            close = text.find('$', pos + 2)
+            if close <= pos + 2 or not text.startswith('$$', close):
+                return None
+
+        else:
+            # Inline math: non-'$' characters, closed by '$', and neither starting nor ending with
+            # whitespace.
+            close = text.find('$', pos + 1)
+            if close == -1 or text[pos + 1].isspace() or text[close - 1].isspace():
+                return None
+
+        return self.compiled_re.match(text, pos)
+
+
+class LatexReplacementProcessor(MathReplacementPattern):
     '''
     This replacement processor identifies and parses Latex math snippets. Each one is passed to
     LatexCompiler, and marked in the document with a temporary placeholder, awaiting the
@@ -598,7 +746,7 @@ class LatexReplacementProcessor(replacement_patterns.ReplacementPattern):
                  prepend: str,
                  doc_class: str,
                  doc_class_options: str):
-        super().__init__(MATH_TEX_RE)
+        super().__init__()
         self.compiler = compiler
         self.prepend = prepend
         self.doc_class = doc_class
@@ -626,14 +774,20 @@ class LatexReplacementProcessor(replacement_patterns.ReplacementPattern):
         return element
 
 
-class LatexMathMLReplacementProcessor(replacement_patterns.ReplacementPattern):
+class LatexMathMLReplacementProcessor(MathReplacementPattern):
     '''
     This replacement processor also identifies and parses Latex math snippets. For each one, we
     invoke latex2mathml to produce a <math>...</math> element representing the Latex math code.
+
+    The MathML code is cached, since latex2mathml is comparatively slow, and the same math code
+    tends to recur, both within a document and across rebuilds.
     '''
 
-    def __init__(self):
-        super().__init__(MATH_TEX_RE)
+    CACHE_PREFIX = 'lamarkdown.latex.mathml'
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
 
     def handle_match(self, match):
 
@@ -642,8 +796,17 @@ class LatexMathMLReplacementProcessor(replacement_patterns.ReplacementPattern):
 
         display_attr = 'block' if latex_block else 'inline'
 
-        mathml_code = latex2mathml.converter.convert(latex_inline or latex_block,
-                                                     display = display_attr)
+        # (Math snippets are short, so unlike LatexCompiler, we key the cache on the code itself.)
+        cache_key = (self.CACHE_PREFIX, display_attr, latex_inline or latex_block)
+        mathml_code = self.cache.get(cache_key)
+        if mathml_code is None:
+            # Imported here, since latex2mathml is comparatively slow to load, and not needed
+            # unless the document actually contains math code.
+            import latex2mathml.converter
+            mathml_code = latex2mathml.converter.convert(latex_inline or latex_block,
+                                                         display = display_attr)
+            self.cache[cache_key] = mathml_code
+
         element = ElementTree.fromstring(mathml_code)
         util.strip_namespaces(element)
         util.opaque_tree(element)
@@ -690,6 +853,13 @@ class LatexExtension(markdown.Extension):
                 p.build_dir if p else 'build',
                 'Location to write temporary files'
             ],
+            'base_dir': [
+                '',
+                'Directory in which Tex will look for local files (e.g., .sty files), in addition '
+                'to the directory of each snippet, and within which (or within the home directory) '
+                'local dependencies are tracked for live updates. Defaults to the current working '
+                'directory.'
+            ],
             'cache': [
                 p.build_cache if p else {},
                 'A dictionary-like cache object to help avoid unnecessary rebuilds.'
@@ -756,6 +926,12 @@ class LatexExtension(markdown.Extension):
                 'error messages. If False (the default), the extension will try to detect the '
                 'start of any actual Tex error message, and only output that.'
             ],
+            'workers': [
+                min(4, os.cpu_count() or 1),
+                'The maximum number of Tex snippets to compile in parallel. By default, this is '
+                'the number of CPUs, up to 4. If 1, snippets are compiled one at a time, in '
+                'document order.'
+            ],
             'math': [
                 MATH_MATHML,
                 'How to handle $...$ and $$...$$ sequences, which are assumed to contain Latex '
@@ -770,6 +946,7 @@ class LatexExtension(markdown.Extension):
         }
         super().__init__(**kwargs)
 
+        self._compiler: LatexCompiler | None = None
         progress = self.getConfig('progress')
 
         embedding = self.getConfig('embedding')
@@ -798,8 +975,10 @@ class LatexExtension(markdown.Extension):
 
         compiler = LatexCompiler(
             md,
-            cache_factors       = (tex, pdf_svg_converter, prepend, doc_class, doc_class_options,
-                                   strip_html_comments, timeout, verbose_errors, math),
+            # The other options (prepend, doc_class, etc.) only affect the output via the Latex
+            # code itself, which forms the rest of the cache key. The embedding doesn't affect the
+            # (cached) SVG code at all.
+            cache_factors       = (tex, pdf_svg_converter),
             build_dir           = self.getConfig('build_dir'),
             cache               = self.getConfig('cache'),
             progress            = self.getConfig('progress'),
@@ -810,7 +989,10 @@ class LatexExtension(markdown.Extension):
             strip_html_comments = strip_html_comments,
             timeout             = timeout,
             verbose_errors      = verbose_errors,
+            workers             = self.getConfig('workers'),
+            base_dir            = self.getConfig('base_dir'),
         )
+        self._compiler = compiler
 
         md.preprocessors.register(
             LatexPreprocessor(
@@ -828,7 +1010,7 @@ class LatexExtension(markdown.Extension):
 
         replacementProcessor: replacement_patterns.ReplacementPattern | None = None
         if math == 'mathml':
-            replacementProcessor = LatexMathMLReplacementProcessor()
+            replacementProcessor = LatexMathMLReplacementProcessor(self.getConfig('cache'))
 
         elif math == 'latex':
             replacementProcessor = LatexReplacementProcessor(
@@ -843,6 +1025,9 @@ class LatexExtension(markdown.Extension):
             md.replacement_patterns.register(replacementProcessor, 'la-latex-replacement', 20)
             md.ESCAPED_CHARS.append('$')
 
+    def reset(self):
+        if self._compiler is not None:
+            self._compiler.reset()
 
 
 def makeExtension(**kwargs):
@@ -33,10 +33,13 @@ class SectionBlockProcessor(markdown.blockprocessors.BlockProcessor):
 
     def __init__(self, md_parser, separator):
         super().__init__(md_parser)
+        self._separator = separator
         self._regex = re.compile(fr'(?x)^[ ]*{re.escape(separator)}([ ]*\n)?({util.ATTR})?\s*$')
 
     def test(self, parent, block):
-        self._match = self._regex.fullmatch(block)
+        # Every block passes through here, and nearly none are separators, so a plain substring
+        # check weeds most of them out before we resort to the regex.
+        self._match = self._separator in block and self._regex.fullmatch(block)
         return self._match
 
     def run(self, parent, blocks):
@@ -34,9 +34,22 @@ from xml.etree import ElementTree
 
 
 class ReplacementPattern:
-    def __init__(self, regex, allow_inline_patterns = False):
+    def __init__(self, regex, allow_inline_patterns = False, start_chars = None):
+        '''
+        If given, 'start_chars' is a string containing every character at which a match could
+        begin. This lets ReplacementProcessor skip directly between candidate positions, rather
+        than attempting the pattern at every position. If None, every position is a candidate.
+        '''
         self.compiled_re = re.compile(regex)
         self.allow_inline_patterns = allow_inline_patterns
+        self.start_chars = start_chars
+
+    def match(self, text, pos):
+        '''
+        Attempts to match the pattern at the given position. Subclasses may override this to
+        reject candidate positions more cheaply than the regex can.
+        '''
+        return self.compiled_re.match(text, pos)
 
     def handle_match(self, match):
         raise NotImplementedError
@@ -46,7 +59,8 @@ class BacktickPassthrough(ReplacementPattern):
     def __init__(self):
         super().__init__(
             '(?P<tic>`+)(?P<code>.+?)(?P=tic)',
-            allow_inline_patterns = True)
+            allow_inline_patterns = True,
+            start_chars = '`')
 
     def handle_match(self, match):
         return match.group(0)
@@ -59,8 +73,19 @@ class ReplacementProcessor(markdown.treeprocessors.Treeprocessor):
 
 
     def run(self, root):
-        repl_patterns = self.md.replacement_patterns  # type: ignore
-        self._process_element(root, list(repl_patterns))
+        repl_patterns = list(self.md.replacement_patterns)  # type: ignore
+
+        # Matches any position worth examining: a backslash (which may escape the following
+        # character), or a character at which some pattern could begin. If any pattern doesn't
+        # declare its start characters, then every position is worth examining.
+        if any(pattern.start_chars is None for pattern in repl_patterns):
+            self._candidate_re = re.compile('.', re.DOTALL)
+        else:
+            start_chars = {ch for pattern in repl_patterns for ch in pattern.start_chars}
+            self._candidate_re = re.compile(
+                '[' + re.escape(''.join(sorted(start_chars | {'\\'}))) + ']')
+
+        self._process_element(root, repl_patterns)
 
 
     def _process_element(self, element, all_patterns):
@@ -77,12 +102,12 @@ class ReplacementProcessor(markdown.treeprocessors.Treeprocessor):
             if new_element is None:
                 break
 
-            ch_index = match.end(0)
             prefix = element.text[:match.start(0)]
-            suffix = element.text[ch_index:]
+            suffix = element.text[match.end(0):]
 
             if isinstance(new_element, str):
                 element.text = f'{prefix}{new_element}{suffix}'
+                ch_index = len(prefix) + len(new_element)
 
             else:  # isinstance(new_element, Element):
                 element.insert(0, new_element)
@@ -102,12 +127,12 @@ class ReplacementProcessor(markdown.treeprocessors.Treeprocessor):
             if new_element is None:
                 break
 
-            ch_index = match.end(0)
             prefix = prev_subelement.tail[:match.start(0)]
             suffix = prev_subelement.tail[match.end(0):]
 
             if isinstance(new_element, str):
                 prev_subelement.tail = f'{prefix}{new_element}{suffix}'
+                ch_index = len(prefix) + len(new_element)
 
             else:  # isinstance(new_element, Element):
                 elem_index += 1
@@ -125,21 +150,32 @@ class ReplacementProcessor(markdown.treeprocessors.Treeprocessor):
         if isinstance(text, markdown.util.AtomicString):
             return None, None
 
-        escaped = False
-        for ch_index in range(start_index, len(text) - start_index):
+        candidate = self._candidate_re.search(text, start_index)
+        while candidate:
+            ch_index = candidate.start()
             if text[ch_index] == '\\':
-                escaped = not escaped
-            else:
-                if not escaped:
-                    for pattern in all_patterns:
-                        match = pattern.compiled_re.match(text, ch_index)
-                        if match:
-                            new_element = pattern.handle_match(match)
-                            if (isinstance(new_element, ElementTree.Element)
-                                    and not pattern.allow_inline_patterns):
-                                opaque_tree(new_element)
-                            return new_element, match
-                escaped = False
+                # Skip over a run of backslashes. An odd number of them escapes the next character.
+                end_index = ch_index
+                while end_index < len(text) and text[end_index] == '\\':
+                    end_index += 1
+
+                candidate = self._candidate_re.search(
+                    text, end_index + (end_index - ch_index) % 2)
+                continue
+
+            ch = text[ch_index]
+            for pattern in all_patterns:
+                if pattern.start_chars is not None and ch not in pattern.start_chars:
+                    continue
+                match = pattern.match(text, ch_index)
+                if match:
+                    new_element = pattern.handle_match(match)
+                    if (isinstance(new_element, ElementTree.Element)
+                            and not pattern.allow_inline_patterns):
+                        opaque_tree(new_element)
+                    return new_element, match
+
+            candidate = self._candidate_re.search(text, ch_index + 1)
 
         return None, None
 
@@ -13,9 +13,11 @@ from lamarkdown.lib import md_compiler
 from lamarkdown.lib.build_params import BuildParams
 
 import watchdog.observers
+import watchdog.observers.polling
 import watchdog.events
 
 from dataclasses import dataclass
+import hashlib
 import http.server
 import json
 import os.path
@@ -23,6 +25,7 @@ import re
 import string
 import threading
 import time
+from typing import Iterable
 import webbrowser
 
 NAME = 'live updating'  # For progress/error messages
@@ -43,7 +46,16 @@ CHECK_INTERVAL       = 500  # milliseconds
 ERROR_COUNTDOWN      = 5    # times the check interval
 DISCONNECT_COUNTDOWN = 30   # times the check interval
 
+# watchdog picks the platform's native file-system notification mechanism (inotify, FSEvents,
+# ReadDirectoryChangesW, etc.) where it can, and otherwise falls back to polling, which only
+# notices changes periodically.
+OBSERVER_CLASS = watchdog.observers.Observer
+IS_POLLING = issubclass(OBSERVER_CLASS, watchdog.observers.polling.PollingObserver)
+
+QUERY_PATH = '/query'
+CLEAN_BUILD_PATH = '/cleanbuild'  # POST only
 POST_RESPONSE = 'ok'
+NOT_FOUND = (404, 'text/plain', '404 - Yeah nah mate.'.encode('utf-8'))
 
 VARIANT_QUERY_REGEX = re.compile('/(?P<variant>[^/]*)/?index.html')
 VARIANT_FILE_QUERY_REGEX = re.compile('/(?P<variant>[^/]*)/(?P<file>.+)')
@@ -104,7 +116,7 @@ UPDATE_SCRIPT_TEMPLATE = string.Template(
         {{
             if(disconnectCountdown > 0)
             {{
-                fetch('/query')
+                fetch('{QUERY_PATH}')
                     .then(response => response.json())
                     .then(json =>
                     {{
@@ -151,7 +163,7 @@ UPDATE_SCRIPT_TEMPLATE = string.Template(
 
         document.getElementById('{CONTROL_PANEL_CLEAN_BUTTON_ID}').onclick = (event) =>
         {{
-            fetch('/cleanbuild', {{method: 'POST'}})
+            fetch('{CLEAN_BUILD_PATH}', {{method: 'POST'}})
                 .then(response => response.text())
                 .then(text =>
                 {{
@@ -226,13 +238,15 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
         self._server: http.server.HTTPServer | None = None
         self._server_thread: threading.Thread | None = None
+        self._server_ready = threading.Event()
 
         self._dependency_files: set[str] = set()
         self._dependency_paths: set[str] = set()
         self._fs_observer: watchdog.observers.Observer | None = None
+        self._content_digests: dict[str, bytes | None] | None = None
 
         self._update_n = 0
-        self._update_event: threading.Event | None = None
+        self._update_condition = threading.Condition()
 
         self._compile_lock = threading.Lock()
         self._compile_thread: threading.Thread | None = None
@@ -243,10 +257,21 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
         return self._update_n
 
 
-    def wait_for_update(self, timeout = 1):
-        if self._update_event is None:
-            self._update_event = threading.Event()
-        return self._update_event.wait(timeout)
+    def wait_for_server(self, timeout = 1):
+        '''
+        Blocks until the server is accepting connections (or until the timeout expires), returning
+        True if it is.
+        '''
+        return self._server_ready.wait(timeout)
+
+
+    def wait_for_update(self, after_n: int, timeout = 1):
+        '''
+        Blocks until the update count exceeds 'after_n' (or until the timeout expires), returning
+        True if it does.
+        '''
+        with self._update_condition:
+            return self._update_condition.wait_for(lambda: self._update_n > after_n, timeout)
 
 
     def read_and_instrument(self):
@@ -267,7 +292,7 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
     def watch_dependencies(self):
         if self._fs_observer is None:
-            self._fs_observer = watchdog.observers.Observer()
+            self._fs_observer = OBSERVER_CLASS()
             self._fs_observer.start()
         else:
             self._fs_observer.unschedule_all()
@@ -297,6 +322,23 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
                     break
 
 
+    @staticmethod
+    def digest_files(files: Iterable[str]) -> dict[str, bytes | None]:
+        '''
+        Digests the contents of each of the given files (None if missing or unreadable), so that
+        we can tell whether anything has actually changed since the last compile (as opposed to,
+        say, a file being re-saved without modification).
+        '''
+        digests: dict[str, bytes | None] = {}
+        for file in files:
+            try:
+                with open(file, 'rb') as f:
+                    digests[file] = hashlib.sha256(f.read()).digest()
+            except OSError:
+                digests[file] = None
+        return digests
+
+
     def on_closed(self, event):
         '''
         Event handler (watchdog.events.FileSystemEventHandler), called when something else finishes
@@ -308,7 +350,7 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
         Once we call recompile(), the set of dependencies will be recalculated.
         '''
         if event.src_path in self._dependency_files:
-            self.recompile()
+            self.recompile(changed_file = event.src_path)
 
     def on_created(self, event):
         '''
@@ -336,7 +378,9 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
 
     def on_deleted(self, event):
-        if event.src_path in self._dependency_files or event.src_path in self._dependency_paths:
+        if event.src_path in self._dependency_files:
+            self.recompile(changed_file = event.src_path)
+        elif event.src_path in self._dependency_paths:
             self.recompile()
 
 
@@ -347,7 +391,13 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
     def run(self,
             address: str = LOOPBACK_ADDRESS,
             port_range: range = DEFAULT_PORT_RANGE,
-            launch_browser: bool  = True):
+            launch_browser: bool  = True,
+            poll_interval: float  = 0.5):
+        '''
+        Runs the server (and monitors the dependency files) until shutdown() is called.
+        'poll_interval' is how often (in seconds) the server loop checks for that, and hence how
+        long shutdown() may have to wait.
+        '''
 
         with self._compile_lock:
             if self._server_thread is not None:
@@ -356,6 +406,7 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
         self.read_and_instrument()
         self.watch_dependencies()
+        self._content_digests = self.digest_files(self._dependency_files)
 
         try:
             # Iterate over a port range, and pick the first free port.
@@ -372,6 +423,10 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
             if port is not None:
                 assert self._server is not None
+                # The server socket is already listening, so connections will queue up until
+                # serve_forever() below begins handling them.
+                self._server_ready.set()
+
                 self._base_build_params.progress.progress(
                     NAME,
                     msg = ('Launching server and browser, and monitoring changes to source/build'
@@ -379,6 +434,12 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
                     advice = (f'Browse to http://{address or "localhost"}:{port}\nPress Ctrl-C to '
                               'quit.'))
 
+                if IS_POLLING:
+                    self._base_build_params.progress.warning(
+                        NAME,
+                        msg = ('No native file-system notifications available; polling for '
+                               'changes instead, so updates may be delayed.'))
+
                 if launch_browser:
                     # We want to open a web browser at the address we're serving, but not before
                     # the server is running. Hence, we start a new thread, which waits 0.5 secs
@@ -389,7 +450,7 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
                     threading.Thread(target = open_browser).start()
 
-                self._server.serve_forever()
+                self._server.serve_forever(poll_interval = poll_interval)
 
             else:
                 self._base_build_params.progress.error(
@@ -401,6 +462,7 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
             pass
 
         finally:
+            self._server_ready.clear()
             with self._compile_lock:
                 compile_thread = self._compile_thread
                 fs_observer = self._fs_observer
@@ -432,7 +494,17 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
         self._base_build_params.build_cache.clear()
 
 
-    def recompile(self):
+    def recompile(self, changed_file: str | None = None):
+        '''
+        Recompiles the document and notifies the browser of the update.
+
+        If the trigger was an event on one of the dependency files ('changed_file'), and all the
+        dependency files are byte-for-byte unchanged since the last compile (e.g., because a file
+        was re-saved without modification), we skip the compile, since it would just reproduce the
+        same output, but still count it as an update. Other triggers (directory events, and the
+        "Clean Build" button) always recompile, since the output may depend on files we don't
+        know about.
+        '''
         with self._compile_lock:
             assert self._fs_observer is not None
             self._fs_observer.stop()
@@ -443,13 +515,19 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
                 # Note: we don't generally expect any exceptions here, but P > 0, and we must try to
                 # keep the interface working as much as we can.
 
-                try:
-                    self._complete_build_params = md_compiler.compile(self._base_build_params)
-                except Exception as e:
-                    self._base_build_params.progress.error(NAME, exception = e)
+                # Digest the files _before_ compiling, so that any changes made during the compile
+                # will register next time.
+                content_digests = self.digest_files(self._dependency_files)
+                compiled = False
+                if changed_file is None or content_digests != self._content_digests:
+                    try:
+                        self._complete_build_params = md_compiler.compile(self._base_build_params)
+                        compiled = True
+                    except Exception as e:
+                        self._content_digests = None
+                        self._base_build_params.progress.error(NAME, exception = e)
 
                 self._base_variant = self._complete_build_params[0].name
-                self._update_n += 1
 
                 try:
                     self.read_and_instrument()
@@ -457,74 +535,126 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
                 except Exception as e:
                     self._base_build_params.progress.error(NAME, exception = e)
 
-                if self._update_event is not None:
-                    self._update_event.set()
+                if compiled:
+                    # The compile may have added or removed dependencies. We keep the pre-compile
+                    # digests of those we already knew about, and digest any new ones now.
+                    content_digests.update(
+                        self.digest_files(self._dependency_files - content_digests.keys()))
+                    self._content_digests = {file: content_digests[file]
+                                             for file in self._dependency_files}
+
+                # Only announce the update once the new output is loaded and we're watching for
+                # further changes. Otherwise, a client could fetch stale output, or make a change
+                # that we miss.
+                with self._update_condition:
+                    self._update_n += 1
+                    self._update_condition.notify_all()
 
             finally:
                 self._compile_thread = None
 
 
+    def main_content(self, variant_name: str) -> bytes:
+        '''
+        Builds the HTML for a given variant, instrumented with the control panel and the script
+        that checks for updates.
+        '''
+        update_script = UPDATE_SCRIPT_TEMPLATE.substitute(
+            {
+                'update_n':             self._update_n,
+                'escaped_variant_name': (variant_name
+                                         .replace('\\', '\\\\')
+                                         .replace("'", "\\'")
+                                         .replace('\n', '\\n'))
+            })
+
+        control_panel = re.sub(
+            r'(\n\s+)+', ' ', rf'''
+            <div id="{CONTROL_PANEL_ID}" data-update-n="{self._update_n}">
+                <div id="{CONTROL_PANEL_TIMESTAMP_ID}"></div>
+                <div id="{CONTROL_PANEL_MESSAGE_ID}"></div>
+                <form>
+                    <button id="{CONTROL_PANEL_CLEAN_BUTTON_ID}">Clean Build</button>
+                </form>
+            ''')
+        if len(self._output_docs) >= 2:
+            control_panel += (
+                '<hr/><strong>Variants</strong><br/>'
+                + '<br/>'.join(
+                    f'<a href="/{doc.name}{"/" if doc.name else ""}index.html">'
+                    f'{doc.filename}</a>'
+                    for doc in self._output_docs.values())
+            )
+        control_panel += '</div>'
+
+        return (
+            self._output_docs[variant_name].full_html
+            .replace('</head>', f'{FAVICON_LINK}\n{CONTROL_PANEL_STYLE}\n</head>')
+            .replace('<body>', f'<body>\n{control_panel}')
+            .replace('</body>', f'{update_script}\n</body>')
+        ).encode('utf-8')
+
+
+    def handle_path(self, path: str) -> tuple[int, str | None, bytes]:
+        '''
+        Determines the response to a GET request for the given path, as a tuple of (HTTP status,
+        content type, body). This is separate from the HTTP machinery itself, so that it can be
+        tested directly.
+        '''
+        default_variant_name = self._base_variant or next(iter(self._output_docs.keys()))
+
+        if path == '/':
+            return (200, 'text/html', self.main_content(default_variant_name))
+
+        if path == QUERY_PATH:
+            return (200, 'application/json', json.JSONEncoder().encode({
+                'update_n': self._update_n,
+                'names': list(self._output_docs.keys())
+            }).encode())
+
+        re_match = VARIANT_QUERY_REGEX.fullmatch(path)
+        if re_match:
+            variant_name = re_match['variant']
+            if variant_name in self._output_docs:
+                return (200, 'text/html', self.main_content(variant_name))
+
+        re_match = VARIANT_FILE_QUERY_REGEX.fullmatch(path)
+        if re_match:
+            variant_name = re_match['variant']
+            if variant_name in self._output_docs:
+                full_path = os.path.join(self._output_docs[variant_name].path,
+                                         re_match['file'].replace('/', os.sep))
+                if os.path.isfile(full_path):
+                    with open(full_path, 'rb') as f:
+                        return (200, None, f.read())
+
+        re_match = BASE_FILE_QUERY_REGEX.fullmatch(path)
+        if re_match:
+            full_path = os.path.join(self._output_docs[default_variant_name].path,
+                                     re_match['file'].replace('/', os.sep))
+            if os.path.isfile(full_path):
+                with open(full_path, 'rb') as f:
+                    return (200, None, f.read())
+
+        return NOT_FOUND
+
+
     def make_handler(self):
         updater_self = self
-        encode_json = json.JSONEncoder().encode
 
         class _handler(http.server.BaseHTTPRequestHandler):
 
-            def send_main_content(self, variant_name: str):
-                self.send_response(200)
-                self.send_header('ContentType', 'text/html')
-                self.end_headers()
-
-                update_script = UPDATE_SCRIPT_TEMPLATE.substitute(
-                    {
-                        'update_n':             updater_self._update_n,
-                        'escaped_variant_name': (variant_name
-                                                 .replace('\\', '\\\\')
-                                                 .replace("'", "\\'")
-                                                 .replace('\n', '\\n'))
-                    })
-
-                control_panel = re.sub(
-                    r'(\n\s+)+', ' ', rf'''
-                    <div id="{CONTROL_PANEL_ID}" data-update-n="{updater_self._update_n}">
-                        <div id="{CONTROL_PANEL_TIMESTAMP_ID}"></div>
-                        <div id="{CONTROL_PANEL_MESSAGE_ID}"></div>
-                        <form>
-                            <button id="{CONTROL_PANEL_CLEAN_BUTTON_ID}">Clean Build</button>
-                        </form>
-                    ''')
-                if len(updater_self._output_docs) >= 2:
-                    control_panel += (
-                        '<hr/><strong>Variants</strong><br/>'
-                        + '<br/>'.join(
-                            f'<a href="/{doc.name}{"/" if doc.name else ""}index.html">'
-                            f'{doc.filename}</a>'
-                            for doc in updater_self._output_docs.values())
-                    )
-                control_panel += '</div>'
-
-                message = (
-                    updater_self._output_docs[variant_name].full_html
-                    .replace('</head>', f'{FAVICON_LINK}\n{CONTROL_PANEL_STYLE}\n</head>')
-                    .replace('<body>', f'<body>\n{control_panel}')
-                    .replace('</body>', f'{update_script}\n</body>')
-                )
-
-                self.wfile.write(message.encode('utf-8'))
-
-
-            def send_file(self, path: str):
-                self.send_response(200)
+            def send(self, status: int, content_type: str | None, body: bytes):
+                self.send_response(status)
+                if content_type is not None:
+                    self.send_header('ContentType', content_type)
                 self.end_headers()
-                self.wfile.write(open(path, 'rb').read())
+                self.wfile.write(body)
 
 
             def do_POST(self):
-                if self.path == '/cleanbuild':
-                    self.send_response(200)
-                    self.send_header('ContentType', 'text/plain')
-                    self.end_headers()
-                    self.wfile.write(POST_RESPONSE.encode('utf-8'))
+                if self.path == CLEAN_BUILD_PATH:
+                    self.send(200, 'text/plain', POST_RESPONSE.encode('utf-8'))
 
                     def clean_build():
                         updater_self.clear_cache()
@@ -532,63 +662,12 @@ class LiveUpdater(watchdog.events.FileSystemEventHandler):
 
                     threading.Thread(target = clean_build).start()
                 else:
-                    self._no()
+                    self.send(*NOT_FOUND)
 
 
             def do_GET(self):
+                self.send(*updater_self.handle_path(self.path))
 
-                default_variant_name = (
-                    updater_self._base_variant
-                    or next(iter(updater_self._output_docs.keys())))
-
-                if self.path == '/':
-                    self.send_main_content(default_variant_name)
-                    return
-
-                if self.path == '/query':
-                    self.send_response(200)
-                    self.send_header('ContentType', 'application/json')
-                    self.end_headers()
-
-                    self.wfile.write(encode_json({
-                        'update_n': updater_self._update_n,
-                        'names': list(updater_self._output_docs.keys())
-                    }).encode())
-                    return
-
-                re_match = VARIANT_QUERY_REGEX.fullmatch(self.path)
-                if re_match:
-                    variant_name = re_match['variant']
-                    if variant_name in updater_self._output_docs:
-                        self.send_main_content(variant_name)
-                        return
-
-                re_match = VARIANT_FILE_QUERY_REGEX.fullmatch(self.path)
-                if re_match:
-                    variant_name = re_match['variant']
-                    if variant_name in updater_self._output_docs:
-                        full_path = os.path.join(updater_self._output_docs[variant_name].path,
-                                                 re_match['file'].replace('/', os.sep))
-                        if os.path.isfile(full_path):
-                            self.send_file(full_path)
-                            return
-
-                re_match = BASE_FILE_QUERY_REGEX.fullmatch(self.path)
-                if re_match:
-                    full_path = os.path.join(
-                        updater_self._output_docs[default_variant_name].path,
-                        re_match['file'].replace('/', os.sep))
-                    if os.path.isfile(full_path):
-                        self.send_file(full_path)
-                        return
-
-                self._no()
-
-            def _no(self):
-                self.send_response(404)
-                self.send_header('ContentType', 'text/plain')
-                self.end_headers()
-                self.wfile.write('404 - Yeah nah mate.'.encode('utf-8'))
 
             def log_message(self, format, *args):
                 pass
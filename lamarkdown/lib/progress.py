@@ -8,6 +8,7 @@ from markdown.util import AtomicString
 from dataclasses import dataclass, field
 import io
 import shutil
+import threading
 import traceback
 from xml.etree import ElementTree
 
@@ -19,6 +20,10 @@ LINE_NUMBER_WIDTH = 4
 
 HIGHLIGHT_COLOUR = '\033[43;30m'
 
+# Messages can arrive from several threads at once (e.g., la.latex compiling snippets in parallel),
+# and each one is printed over several lines. All of them share the one terminal.
+PRINT_LOCK = threading.Lock()
+
 
 def wrap(text, width):
     line_number = 1
@@ -260,9 +265,10 @@ class Progress:
 
 
     def show(self, msg: Message):
-        msg.print()
-        if isinstance(msg, ErrorMsg):
-            self._errors.append(msg)
+        with PRINT_LOCK:
+            msg.print()
+            if isinstance(msg, ErrorMsg):
+                self._errors.append(msg)
         return msg
 
 
@@ -1,6 +1,8 @@
+from __future__ import annotations
 from ..util import mock_progress, html_block_processor
-from ..util.markdown_ext import entry_point_cls
+from ..util.markdown_ext import config_key, dedent_strip, entry_point_cls
 import lamarkdown.ext
+import lamarkdown.ext.cite
 
 import unittest
 from unittest.mock import patch
@@ -12,7 +14,6 @@ import lxml.html
 
 import sys
 import tempfile
-from textwrap import dedent
 
 sys.modules['la'] = sys.modules['lamarkdown.ext']
 
@@ -52,22 +53,38 @@ class CiteTestCase(unittest.TestCase):
     # @misc{refC...} gives us a <dd> element with no sub-elements, which helps test a particular
     # path in cite.py.
 
+    # Markdown instances (and their MockProgress objects), shared between tests with identical
+    # configurations.
+    _md_cache: dict[tuple, tuple[markdown.Markdown, mock_progress.MockProgress]] = {}
+
     def run_markdown(self,
                      markdown_text,
                      more_extensions = [],
                      expect_error = False,
                      hook = lambda md: None,
                      **kwargs):
-        self.progress = mock_progress.MockProgress(expect_error = expect_error)
-        md = markdown.Markdown(
-            extensions = ['la.cite', *more_extensions],
-            extension_configs = {'la.cite': {
-                'progress': self.progress,
-                **kwargs
-            }}
-        )
-        hook(md)
-        return md.convert(dedent(markdown_text).strip())
+        # Reuse Markdown instances between calls with identical configurations. We don't do this
+        # where errors are expected, as some of those arise when the extension is initialised.
+        key = None if expect_error else config_key(more_extensions, hook, **kwargs)
+        if key in self._md_cache:
+            md, self.progress = self._md_cache[key]
+            md.reset()
+            self.progress.reset()
+
+        else:
+            self.progress = mock_progress.MockProgress(expect_error = expect_error)
+            md = markdown.Markdown(
+                extensions = ['la.cite', *more_extensions],
+                extension_configs = {'la.cite': {
+                    'progress': self.progress,
+                    **kwargs
+                }}
+            )
+            hook(md)
+            if key is not None:
+                self._md_cache[key] = (md, self.progress)
+
+        return md.convert(dedent_strip(markdown_text))
 
 
     def test_unused(self):
@@ -502,6 +519,77 @@ class CiteTestCase(unittest.TestCase):
             })))
 
 
+    def test_reset(self):
+        '''Check that a Markdown instance can be reused without citations carrying over.'''
+
+        with tempfile.TemporaryDirectory() as dir:
+            with open(f'{dir}/referencesX.bib', 'w') as f:
+                f.write(r'''
+                    @article{refX,
+                        author = "The Author X",
+                        title = "The Title X",
+                        journal = "The Journal X",
+                        year = "1999"
+                    }
+                ''')
+
+            md = markdown.Markdown(
+                extensions = ['la.cite', 'meta'],
+                extension_configs = {'la.cite': {
+                    'progress': mock_progress.MockProgress(),
+                    'file': [],
+                    'references': self.REFERENCES
+                }}
+            )
+            html = md.convert(f'bibliography: {dir}/referencesX.bib\n\n[@refA] [@refB] [@refX]')
+            self.assertEqual(html.count('<dt'), 3)
+
+            md.reset()
+            html = md.convert('[@refC] [@refX]')
+            self.assertEqual(html.count('<dt'), 1)
+            self.assertIn('[@refX]', html)
+
+
+    def test_format_memoisation(self):
+        '''
+        Check that the same references aren't re-formatted across documents, even by separate
+        Markdown instances, unless the reference data changes.
+        '''
+
+        def convert(text, references = self.REFERENCES):
+            return markdown.Markdown(
+                extensions = ['la.cite'],
+                extension_configs = {'la.cite': {
+                    'progress': mock_progress.MockProgress(),
+                    'file': [],
+                    'references': references
+                }}
+            ).convert(text)
+
+        import pybtex.style.formatting.unsrt
+        style_cls = pybtex.style.formatting.unsrt.Style
+        with patch.dict(lamarkdown.ext.cite._formatted_entries, clear = True), \
+                patch.object(style_cls, 'format_entry', autospec = True,
+                             side_effect = style_cls.format_entry) as format_entry:
+
+            html1 = convert('[@refA] [@refB]')
+            self.assertEqual(format_entry.call_count, 2)
+
+            html2 = convert('[@refA] [@refB]')
+            self.assertEqual(format_entry.call_count, 2)
+            self.assertEqual(html1, html2)
+
+            # A different label (here, due to a different citation order) means re-formatting.
+            convert('[@refB] [@refA]')
+            self.assertEqual(format_entry.call_count, 4)
+
+            # So does a change to the entry itself.
+            html3 = convert('[@refA] [@refB]',
+                            references = self.REFERENCES.replace('The Title A', 'New Title A'))
+            self.assertEqual(format_entry.call_count, 5)
+            self.assertIn('New title a', html3)
+
+
     def test_nl2br_interaction(self):
         html = self.run_markdown(
             r'''
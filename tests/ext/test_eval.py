@@ -1,5 +1,6 @@
+from __future__ import annotations
 from ..util.mock_progress import MockProgress
-from ..util.markdown_ext import entry_point_cls
+from ..util.markdown_ext import config_key, dedent_strip, entry_point_cls
 import unittest
 from unittest.mock import patch
 from hamcrest import assert_that, contains_exactly, has_property, instance_of, is_, same_instance
@@ -10,20 +11,52 @@ import markdown
 import datetime
 import re
 import sys
-from textwrap import dedent
 
 sys.modules['la'] = sys.modules['lamarkdown.ext']
 
+# Expected output, compiled once up front. (The date pattern in test_date depends on today's date,
+# so that one stays inline.)
+CUSTOM_REPLACEMENT_REGEX = re.compile(r'''(?x)
+    <p>Sometext[ ]
+    <span>
+    test[ ]replacement
+    </span>
+    [ ]sometext</p>
+''')
+
+CODE_EVAL_REGEX = re.compile(r'''(?x)
+    <p>Sometext[ ]
+    <span>
+    333
+    </span>
+    [ ]sometext</p>
+''')
+
 
 class EvalTestCase(unittest.TestCase):
 
+    # Markdown instances (and their MockProgress objects), shared between tests with identical
+    # configurations.
+    _md_cache: dict[tuple, tuple[markdown.Markdown, MockProgress]] = {}
+
     def run_markdown(self, markdown_text, expect_error = False, **kwargs):
-        self.progress = MockProgress(expect_error)
-        md = markdown.Markdown(
-            extensions = ['la.eval'],
-            extension_configs = {'la.eval': {'progress': self.progress, **kwargs}}
-        )
-        return md.convert(dedent(markdown_text).strip())
+        # As in test_cite, we don't reuse instances where errors are expected.
+        key = None if expect_error else config_key(**kwargs)
+        if key in self._md_cache:
+            md, self.progress = self._md_cache[key]
+            md.reset()
+            self.progress.reset()
+
+        else:
+            self.progress = MockProgress(expect_error)
+            md = markdown.Markdown(
+                extensions = ['la.eval'],
+                extension_configs = {'la.eval': {'progress': self.progress, **kwargs}}
+            )
+            if key is not None:
+                self._md_cache[key] = (md, self.progress)
+
+        return md.convert(dedent_strip(markdown_text))
 
 
     def test_date(self):
@@ -55,16 +88,7 @@ class EvalTestCase(unittest.TestCase):
                 replace = replace
             )
 
-            self.assertRegex(
-                html,
-                r'''(?x)
-                <p>Sometext[ ]
-                <span>
-                test[ ]replacement
-                </span>
-                [ ]sometext</p>
-                '''
-            )
+            self.assertRegex(html, CUSTOM_REPLACEMENT_REGEX)
 
 
     def test_code_eval(self):
@@ -75,16 +99,7 @@ class EvalTestCase(unittest.TestCase):
             allow_exec = True
         )
 
-        self.assertRegex(
-            html,
-            r'''(?x)
-            <p>Sometext[ ]
-            <span>
-            333
-            </span>
-            [ ]sometext</p>
-            '''
-        )
+        self.assertRegex(html, CODE_EVAL_REGEX)
 
 
     def test_code_eval_disabled(self):
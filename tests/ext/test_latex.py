@@ -1,6 +1,6 @@
 from ..util.mock_progress import MockProgress
 from ..util.mock_cache import MockCache
-from ..util.markdown_ext import entry_point_cls
+from ..util.markdown_ext import config_key, dedent_strip, entry_point_cls
 import unittest
 from unittest.mock import patch
 from hamcrest import (all_of, assert_that, contains_exactly, contains_inanyorder, contains_string,
@@ -9,80 +9,93 @@ from hamcrest import (all_of, assert_that, contains_exactly, contains_inanyorder
 
 import lamarkdown.ext.latex
 import markdown
-import lxml
 
 import base64
+import glob
 import os.path
 import re
 import sys
 import tempfile
+import threading
 from textwrap import dedent
 
 sys.modules['la'] = sys.modules['lamarkdown.ext']
 
+# The SVG content produced by the mock pdf2svg command, with whitespace removed. This is constant,
+# so we only need to normalise it once.
+MOCK_SVG = re.sub(
+    r'\n\s*',
+    '',
+    '''
+    <svg xmlns="http://www.w3.org/2000/svg" width="45" height="15" viewBox="1 1 1 1">
+        <text x="0" y="15">mock</text>
+    </svg>
+    '''
+)
+MOCK_SVG_B64 = base64.b64encode(MOCK_SVG.encode('utf-8')).decode('utf-8')
+
+# A tiny Python script to act as a mock 'tex' compiler. Individual tests may append to it.
+MOCK_TEX_SCRIPT = dedent(
+    r'''
+    import sys
+    import shutil
+    import os
+
+    # If the .tex file (the one at the known location we're about to copy to) already exists, find
+    # a new name. This lets us write test cases with multiple Latex snippets.
+    tex_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output.tex')
+    if os.path.exists(tex_file):
+        index = 1
+        while os.path.exists(tex_file + str(index)):
+            index += 1
+        tex_file = tex_file + str(index)
+
+    # Copy the .tex file to a known location, so the test case can find and read it.
+    actual_tex_file = sys.argv[1]
+    shutil.copyfile(actual_tex_file, tex_file)
+
+    # Generate a mock .pdf file to satisfy the production code's checks.
+    mock_pdf_file = sys.argv[2]
+    with open(mock_pdf_file, 'w') as writer:
+        writer.write("mock")
+    '''
+)
+
+# Another tiny Python script to act as a mock 'pdf2svg' converter.
+MOCK_PDF2SVG_SCRIPT = dedent(
+    f'''
+    import sys
+
+    # Generate a mock output .svg file.
+    mock_svg_file = sys.argv[2]
+    with open(mock_svg_file, 'w') as writer:
+        writer.write('{MOCK_SVG}')
+    '''
+)
+
+SVG_TAG_RE = re.compile(r'<svg[^>]*><text[^>]*>mock</text></svg>')
+IMG_TAG_RE = re.compile(r'<img[^>]+>')
+
 
 class LatexTestCase(unittest.TestCase):
     def setUp(self):
         self.progress = None
+        self.md_instances = {}
         self.tmp_dir_context = tempfile.TemporaryDirectory()
         self.tmp_dir = self.tmp_dir_context.__enter__()
 
+        # The mock tex compiler writes 'output.tex' (and 'output.tex1', etc.) alongside itself.
         self.tex_file = os.path.join(self.tmp_dir, 'output.tex')
+        self.tex_paths = {}
         self.mock_tex_command = os.path.join(self.tmp_dir, 'mock_tex_command')
         with open(self.mock_tex_command, 'w') as writer:
+            writer.write(MOCK_TEX_SCRIPT)
 
-            # Create a tiny Python script to act as a mock 'tex' compiler.
-            writer.write(dedent(
-                fr'''
-                import sys
-                import shutil
-                import os
-
-                # If the .tex file (the one at the known location we're about to copy to) already
-                # exists, find a new name. This lets us write test cases with multiple Latex
-                # snippets.
-                tex_file = '{self.tex_file}'
-                if os.path.exists(tex_file):
-                    index = 1
-                    while os.path.exists(tex_file + str(index)):
-                        index += 1
-                    tex_file = tex_file + str(index)
-
-                # Copy the .tex file to a known location, so the test case can find and read it.
-                actual_tex_file = sys.argv[1]
-                shutil.copyfile(actual_tex_file, tex_file)
-
-                # Generate a mock .pdf file to satisfy the production code's checks.
-                mock_pdf_file = sys.argv[2]
-                with open(mock_pdf_file, 'w') as writer:
-                    writer.write("mock")
-                '''
-            ))
-
-        self.mock_svg = re.sub(
-            r'\n\s*',
-            '',
-            '''
-            <svg xmlns="http://www.w3.org/2000/svg" width="45" height="15" viewBox="1 1 1 1">
-                <text x="0" y="15">mock</text>
-            </svg>
-            '''
-        )
+        self.mock_svg = MOCK_SVG
 
         self.mock_pdf2svg_command = os.path.join(self.tmp_dir, 'mock_pdf2svg_command')
         with open(self.mock_pdf2svg_command, 'w') as writer:
-
-            # Create another tiny Python script to act as a mock 'pdf2svg' converter.
-            writer.write(dedent(
-                fr'''
-                import sys
-
-                # Generate a mock output .svg file.
-                mock_svg_file = sys.argv[2]
-                with open(mock_svg_file, 'w') as writer:
-                    writer.write('{self.mock_svg}')
-                '''
-            ))
+            writer.write(MOCK_PDF2SVG_SCRIPT)
 
 
 
@@ -95,34 +108,64 @@ class LatexTestCase(unittest.TestCase):
                      extra_extensions: list = [],
                      expect_error: bool = False,
                      **kwargs):
-        self.progress = MockProgress(expect_error = expect_error)
-        md = markdown.Markdown(
-            extensions = ['la.latex', *extra_extensions],
-            extension_configs = {
-                'la.latex': {
-                    'build_dir': self.tmp_dir,
-                    'progress': self.progress,
-                    'tex': f'python {self.mock_tex_command} in.tex out.pdf',
-                    'pdf_svg_converter': f'python {self.mock_pdf2svg_command} in.pdf out.svg',
-                    **kwargs
+        # Where the configuration is the same as a previous call (within the same test), reuse the
+        # existing Markdown instance, rather than re-initialising all the extensions. (We can't do
+        # this if any config values are mutable objects, like caches, since the test may inspect
+        # or modify them between calls. config_key() gives None in that case.)
+        key = config_key(self.tmp_dir, extra_extensions, expect_error, **kwargs)
+
+        if key in self.md_instances:
+            md, self.progress = self.md_instances[key]
+            md.reset()
+            self.progress.reset()
+
+        else:
+            self.progress = MockProgress(expect_error = expect_error)
+            md = markdown.Markdown(
+                extensions = ['la.latex', *extra_extensions],
+                extension_configs = {
+                    'la.latex': {
+                        'build_dir': self.tmp_dir,
+                        'progress': self.progress,
+                        'tex': f'python {self.mock_tex_command} in.tex out.pdf',
+                        'pdf_svg_converter': f'python {self.mock_pdf2svg_command} in.pdf out.svg',
+
+                        # Compile one snippet at a time by default, so that the mock compiler
+                        # numbers its copies of the .tex files in document order.
+                        'workers': 1,
+                        **kwargs
+                    }
                 }
-            }
-        )
-        return md.convert(dedent(markdown_text).strip())
+            )
+            if key is not None:
+                self.md_instances[key] = (md, self.progress)
+
+        return md.convert(dedent_strip(markdown_text))
+
+
+    def tex_path(self, file_index = ''):
+        '''
+        Returns the path of the N-th .tex file copied out by the mock compiler (where the 0th has
+        no numeric suffix).
+        '''
+        path = self.tex_paths.get(file_index)
+        if path is None:
+            path = self.tex_paths[file_index] = f'{self.tex_file}{file_index or ""}'
+        return path
 
 
     def assert_tex_regex(self, regex, file_index = ''):
-        with open(f'{self.tex_file}{file_index or ""}', 'r') as reader:
+        with open(self.tex_path(file_index), 'r') as reader:
             tex = reader.read()
 
-        self.assertRegex(
-            tex, regex,
-            f'generated Tex code (#{file_index or 0}) does not match expected pattern\n---actual '
-            f'tex---\n{tex}\n---expected pattern---\n{dedent(regex).strip()}')
+        if not re.search(regex, tex):
+            self.fail(
+                f'generated Tex code (#{file_index or 0}) does not match expected pattern\n'
+                f'---actual tex---\n{tex}\n---expected pattern---\n{dedent_strip(regex)}')
 
     @property
     def mock_svg_b64(self):
-        return base64.b64encode(self.mock_svg.encode('utf-8')).decode('utf-8')
+        return MOCK_SVG_B64
 
 
     def test_single_env(self):
@@ -272,7 +315,7 @@ class LatexTestCase(unittest.TestCase):
         self.assertIn('<p>Paragraph1</p>', html)
         self.assertIn('<p>Paragraph2</p>', html)
 
-        img_tag = re.search('<img[^>]+>', html).group(0)
+        img_tag = IMG_TAG_RE.search(html).group(0)
         self.assertIn('alt="alt text"', img_tag)
         self.assertIn('width="5"', img_tag)
         self.assertIn('id="myid"', img_tag)
@@ -521,7 +564,7 @@ class LatexTestCase(unittest.TestCase):
             ''',
             embedding = 'svg_element')
 
-        self.assertRegex(html, r'<svg[^>]*><text[^>]*>mock</text></svg>')
+        self.assertRegex(html, SVG_TAG_RE)
 
 
     def test_latex_options(self):
@@ -624,6 +667,87 @@ class LatexTestCase(unittest.TestCase):
 
 
 
+    def test_multiple_parallel(self):
+        '''Check that multiple Latex snippets can be compiled in parallel.'''
+        html = self.run_markdown(
+            r'''
+            Paragraph1
+
+            \begin{document}
+                Latex code 0
+            \end{document}
+
+            \begin{document}
+                Latex code 1
+            \end{document}
+
+            \begin{document}
+                Latex code 0
+            \end{document}
+
+            \begin{document}
+                Latex code 2
+            \end{document}
+            {#myid}
+            ''',
+            workers = 3)
+
+        # The mock compiler's own copies of the .tex files may be unreliable when run in parallel,
+        # so we look at the build directories instead. There should be one for each distinct
+        # snippet.
+        tex_code = set()
+        for build_dir in glob.glob(os.path.join(self.tmp_dir, 'latex-*')):
+            self.assertTrue(os.path.exists(os.path.join(build_dir, 'job.pdf')))
+            with open(os.path.join(build_dir, 'job.tex')) as reader:
+                tex_code.add(re.search('Latex code [0-9]', reader.read()).group(0))
+
+        self.assertEqual(tex_code, {'Latex code 0', 'Latex code 1', 'Latex code 2'})
+
+        self.assertEqual(
+            4, html.count(f'<img src="data:image/svg+xml;base64,{self.mock_svg_b64}'),
+            'There should be 4 <img> elements, one for each Latex snippet')
+        self.assertEqual(1, html.count('id="myid"'))
+
+
+    def test_parallel_shutdown(self):
+        '''
+        Check that the worker threads are shut down once there's nothing left to compile, even if
+        the HTML is never requested (here, because a treeprocessor fails).
+        '''
+
+        class FailingTreeprocessor(markdown.treeprocessors.Treeprocessor):
+            def run(self, root):
+                raise RuntimeError('mock failure')
+
+        ext = lamarkdown.ext.latex.LatexExtension(
+            build_dir = self.tmp_dir,
+            progress = MockProgress(),
+            tex = f'python {self.mock_tex_command} in.tex out.pdf',
+            pdf_svg_converter = f'python {self.mock_pdf2svg_command} in.pdf out.svg',
+            workers = 2)
+        md = markdown.Markdown(extensions = [ext])
+        md.treeprocessors.register(FailingTreeprocessor(md), 'failing', 0)
+
+        with self.assertRaises(RuntimeError):
+            md.convert(dedent_strip(
+                r'''
+                \begin{document}
+                    Latex code 0
+                \end{document}
+
+                \begin{document}
+                    Latex code 1
+                \end{document}
+                '''))
+
+        for thread in threading.enumerate():
+            if thread.name.startswith(lamarkdown.ext.latex.NAME):
+                thread.join(timeout = 5)
+                self.assertFalse(thread.is_alive())
+
+        self.assertIsNone(ext._compiler._executor)
+
+
     def test_multiple_cached(self):
         '''
         Check that, when processing multiple identical Latex snippets, we use the cache rather than
@@ -662,8 +786,8 @@ class LatexTestCase(unittest.TestCase):
             \s* $
         ''')
 
-        self.assertFalse(os.path.exists(f'{self.tex_file}1'))
-        self.assertFalse(os.path.exists(f'{self.tex_file}2'))
+        self.assertFalse(os.path.exists(self.tex_path(1)))
+        self.assertFalse(os.path.exists(self.tex_path(2)))
 
         for i in [1, 2, 3, 4]:
             self.assertIn(f'<p>Paragraph{i}</p>', html)
@@ -673,6 +797,38 @@ class LatexTestCase(unittest.TestCase):
             'There should be 3 <img> elements, one for each Latex snippet')
 
 
+    def test_cache_factors(self):
+        '''
+        Check that the cache is still used when options not affecting the output change, but not
+        when ones that do affect it change.
+        '''
+
+        cache = MockCache()
+        for kwargs in [
+            {},
+            {'timeout': 5, 'verbose_errors': True, 'embedding': 'svg_element'},
+            {'tex': f'python  {self.mock_tex_command} in.tex out.pdf'}
+        ]:
+            html = self.run_markdown(
+                r'''
+                \begin{document}
+                    Latex code
+                \end{document}
+                ''',
+                cache = cache,
+                **kwargs)
+
+            if kwargs.get('embedding') == 'svg_element':
+                self.assertIn('<svg', html, 'Cached SVG code should be embedded as an element')
+
+        self.assertTrue(os.path.exists(self.tex_path(1)),
+                        'Tex should be re-run when the tex command changes')
+        self.assertFalse(os.path.exists(self.tex_path(2)),
+                         'Tex should not be re-run when only the timeout/verbosity/embedding '
+                         'changes')
+        self.assertEqual(len(cache), 2)
+
+
     def test_converter_corrections(self):
         svg = '''
             <svg version='1.1'
@@ -738,12 +894,12 @@ class LatexTestCase(unittest.TestCase):
         '''
 
         with open(self.mock_tex_command, 'w') as f:
-            # Use a different mock 'tex' compiler here. It waits for only 1 second, but we set the
-            # timeout to 0.5 seconds below. (Certainly no need for a real infinite loop!)
+            # Use a different mock 'tex' compiler here. It waits for only 0.3 seconds, but we set
+            # the timeout to 0.1 seconds below. (Certainly no need for a real infinite loop!)
             f.write(dedent('''
                 import sys
                 import time
-                time.sleep(1)
+                time.sleep(0.3)
                 mock_pdf_file = sys.argv[2]
                 with open(mock_pdf_file, 'w') as f:
                     f.write('mock')
@@ -756,7 +912,7 @@ class LatexTestCase(unittest.TestCase):
             \end{document}
             ''',
             expect_error = True,
-            timeout = 0.5
+            timeout = 0.1
         )
         assert_that(
             self.progress.error_messages,
@@ -774,25 +930,24 @@ class LatexTestCase(unittest.TestCase):
         '''
 
         with open(self.mock_tex_command, 'w') as f:
-            # Use a different mock 'tex' compiler here. It waits 1.2 seconds collectively, more
-            # than the timeout value, but with intervening output to 'keep it alive'.
+            # Use a different mock 'tex' compiler here. It runs for 0.9 seconds, more than the
+            # timeout value, but with output every 0.1 seconds to 'keep it alive'. It also produces
+            # output as soon as it starts, so the first gap is just the interpreter's start-up time
+            # (which can be considerable on a loaded machine, such as when the tests run in
+            # parallel). The gaps must be well short of the timeout, since la.latex only checks for
+            # output every 0.1 seconds.
             f.write(dedent('''
                 import sys
                 import time
-                time.sleep(0.4)
-                print('keepalive output')
-                time.sleep(0.4)
-                print('keepalive output')
-                time.sleep(0.4)
                 print('keepalive output')
+                for _ in range(9):
+                    time.sleep(0.1)
+                    print('keepalive output')
                 mock_pdf_file = sys.argv[2]
                 with open(mock_pdf_file, 'w') as f:
                     f.write('mock')
             '''))
 
-        # Ensures that the mock compiler doesn't buffer its output.
-        os.environ["PYTHONUNBUFFERED"] = "1"
-
         self.run_markdown(
             r'''
             \begin{document}
@@ -800,7 +955,11 @@ class LatexTestCase(unittest.TestCase):
             \end{document}
             ''',
             expect_error = True,
-            timeout = 0.5
+            timeout = 0.8,
+
+            # '-u' ensures that the mock compiler doesn't buffer its output. (We avoid setting
+            # PYTHONUNBUFFERED, since that would leak into all subsequent tests.)
+            tex = f'python -u {self.mock_tex_command} in.tex out.pdf'
         )
         assert_that(
             self.progress.error_messages,
@@ -987,6 +1146,8 @@ class LatexTestCase(unittest.TestCase):
 
 
     def test_math_ignored(self):
+        from lxml import html as lxml_html
+
         html = self.run_markdown(
             r'''
             Text1 $math$ Text2
@@ -995,16 +1156,18 @@ class LatexTestCase(unittest.TestCase):
             ''',
             math = 'ignore')
 
-        root = lxml.html.fromstring(html)
+        root = lxml_html.fromstring(html)
 
         assert_that(
-            root.xpath('//math | //svg | //img'),
+            list(root.iter('math', 'svg', 'img')),
             empty())
 
         self.assertFalse(os.path.exists(self.tex_file))
 
 
     def test_math_escaped(self):
+        from lxml import html as lxml_html
+
         for input_text,          expected_output in [
             (r'\$math$',         r'$math$'),
             (r'\\\$math$',       r'\$math$'),
@@ -1015,9 +1178,9 @@ class LatexTestCase(unittest.TestCase):
                 f'Text1{input_text}Text2',
                 math = 'mathml')
 
-            root = lxml.html.fromstring(html)
+            root = lxml_html.fromstring(html)
             assert_that(
-                root.xpath('//math | //svg | //img'),
+                list(root.iter('math', 'svg', 'img')),
                 empty())
 
             assert_that(
@@ -1028,6 +1191,8 @@ class LatexTestCase(unittest.TestCase):
 
 
     def test_math_attr(self):
+        from lxml import html as lxml_html
+
         for math in ['latex', 'mathml']:
             for embedding in ['data_uri', 'svg_element']:
                 html = self.run_markdown(
@@ -1039,7 +1204,7 @@ class LatexTestCase(unittest.TestCase):
                     math = math,
                     embedding = embedding)
 
-                for element in lxml.html.fromstring(html).xpath('//math | //svg | //img'):
+                for element in lxml_html.fromstring(html).iter('math', 'svg', 'img'):
                     assert_that(
                         element.attrib,
                         has_entries({'id': 'test-id',
@@ -1048,115 +1213,131 @@ class LatexTestCase(unittest.TestCase):
 
 
     def test_math_corner_cases(self):
+        from lxml import html as lxml_html
+
         for inp in ['$x$', '$$x$$', '$x$$', '$$x$', ' $x$ ', ' $$x$$ ', 'x$y$z', 'x$$y$$z',
                     'x$y$', '$x$y']:
             assert_that(
-                lxml.html.fromstring(self.run_markdown(inp)).xpath('//math | //svg | //img'),
-                contains_exactly(not_none()))
+                list(lxml_html.fromstring(self.run_markdown(inp)).iter('math', 'svg', 'img')),
+                contains_exactly(not_none()),
+                inp)
 
         for inp in ['$', '$$', ' $$ ', ' x$$y ', '$$$', '$$$$', '$$$$$',
                     '$x', 'x$', '$$x', 'x$$', ' x$ ', ' $x ', '$xy']:
             assert_that(
-                lxml.html.fromstring(self.run_markdown(inp)).xpath('//math | //svg | //img'),
-                empty())
+                list(lxml_html.fromstring(self.run_markdown(inp)).iter('math', 'svg', 'img')),
+                empty(),
+                inp)
 
 
-    def test_math_inline_latex(self):
+    def test_math_inline_latex_data_uri(self):
+        self._test_math_inline_latex('data_uri', 'img')
 
-        for embedding, tag in [
-            ('data_uri', 'img'),
-            ('svg_element', 'svg'),
-        ]:
-            html1 = self.run_markdown(
-                r'''
-                Text1 $inline-math0$
 
-                $inline-math1$ Text2
+    def test_math_inline_latex_svg_element(self):
+        self._test_math_inline_latex('svg_element', 'svg')
 
-                Text1 $inline-math2$ Text2
-                ''',
-                math = 'latex',
-                embedding = embedding)
 
-            assert_that(
-                lxml.html.fromstring(html1).xpath(f'count(//{tag})'),
-                is_(3))
-
-            for index in [0, 1, 2]:
-                self.assert_tex_regex(
-                    fr'''(?x)
-                    \s* \\begin \{{document\}}
-                    \s* \$inline-math{index}\$
-                    \s* \\end \{{document\}}
-                    ''',
-                    file_index = index
-                )
+    def _test_math_inline_latex(self, embedding, tag):
+        from lxml import html as lxml_html
 
-            html2 = self.run_markdown(
-                r'''
-                Text1 $ inline-math3$ Text2
+        html1 = self.run_markdown(
+            r'''
+            Text1 $inline-math0$
 
-                Text1 $inline-math4 $ Text2
+            $inline-math1$ Text2
 
-                Text1 $
-                inline-math5$ Text2
+            Text1 $inline-math2$ Text2
+            ''',
+            math = 'latex',
+            embedding = embedding)
 
-                Text1 $inline-math6
-                $ Text2
+        assert_that(
+            len(list(lxml_html.fromstring(html1).iter(tag))),
+            is_(3))
+
+        for index in [0, 1, 2]:
+            self.assert_tex_regex(
+                fr'''(?x)
+                \s* \\begin \{{document\}}
+                \s* \$inline-math{index}\$
+                \s* \\end \{{document\}}
                 ''',
-                math = 'latex',
-                embedding = embedding)
+                file_index = index
+            )
 
-            assert_that(
-                lxml.html.fromstring(html2).xpath(f'//{tag}'),
-                empty())
+        html2 = self.run_markdown(
+            r'''
+            Text1 $ inline-math3$ Text2
 
+            Text1 $inline-math4 $ Text2
 
-    def test_math_block_latex(self):
+            Text1 $
+            inline-math5$ Text2
 
-        for embedding, tag in [
-            ('data_uri', 'img'),
-            ('svg_element', 'svg'),
-        ]:
-            html = self.run_markdown(
-                r'''
-                Text1 $$block-math0$$
+            Text1 $inline-math6
+            $ Text2
+            ''',
+            math = 'latex',
+            embedding = embedding)
 
-                $$block-math1$$ Text2
+        assert_that(
+            list(lxml_html.fromstring(html2).iter(tag)),
+            empty())
 
-                Text1 $$block-math2$$ Text2
 
-                Text1 $$ block-math3$$ Text2
+    def test_math_block_latex_data_uri(self):
+        self._test_math_block_latex('data_uri', 'img')
 
-                Text1 $$block-math4 $$ Text2
 
-                Text1 $$
-                block-math5$$ Text2
+    def test_math_block_latex_svg_element(self):
+        self._test_math_block_latex('svg_element', 'svg')
 
-                Text1 $$block-math6
-                $$ Text2
-                ''',
-                math = 'latex',
-                embedding = embedding)
 
-            assert_that(
-                lxml.html.fromstring(html).xpath(f'count(//{tag})'),
-                is_(7))
-
-            for index in [0, 1, 2, 3, 4, 5, 6]:
-                self.assert_tex_regex(
-                    fr'''(?x)
-                    \s* \\begin \{{document\}}
-                    \s* \$\\displaystyle ({{}} | \s) \s* block-math{index} \s* \$
-                    \s* \\end \{{document\}}
-                    ''',
-                    file_index = index
-                )
+    def _test_math_block_latex(self, embedding, tag):
+        from lxml import html as lxml_html
+
+        html = self.run_markdown(
+            r'''
+            Text1 $$block-math0$$
+
+            $$block-math1$$ Text2
+
+            Text1 $$block-math2$$ Text2
+
+            Text1 $$ block-math3$$ Text2
+
+            Text1 $$block-math4 $$ Text2
+
+            Text1 $$
+            block-math5$$ Text2
+
+            Text1 $$block-math6
+            $$ Text2
+            ''',
+            math = 'latex',
+            embedding = embedding)
+
+        assert_that(
+            len(list(lxml_html.fromstring(html).iter(tag))),
+            is_(7))
+
+        for index in [0, 1, 2, 3, 4, 5, 6]:
+            self.assert_tex_regex(
+                fr'''(?x)
+                \s* \\begin \{{document\}}
+                \s* \$\\displaystyle ({{}} | \s) \s* block-math{index} \s* \$
+                \s* \\end \{{document\}}
+                ''',
+                file_index = index
+            )
 
 
     @patch('latex2mathml.converter.convert',
            lambda latex, display = 'inline': f'<math>{latex}-{display}</math>')
     def test_math_mathml(self):
+        from lxml import html as lxml_html
+
 
         html = self.run_markdown(
             r'''
@@ -1175,13 +1356,38 @@ class LatexTestCase(unittest.TestCase):
             math = 'mathml')
 
         assert_that(
-            lxml.html.fromstring(html).xpath('//math/text()'),
+            [e.text for e in lxml_html.fromstring(html).iter('math')],
             contains_exactly('math0-inline', 'math1-inline', 'math2-inline',
                              'math3-block', 'math4-block', 'math5-block'))
 
         self.assertFalse(os.path.exists(self.tex_file))
 
 
+    def test_math_mathml_cache(self):
+        from lxml import html as lxml_html
+
+        cache = MockCache()
+        with patch('latex2mathml.converter.convert',
+                   side_effect = lambda latex, display: f'<math>{latex}-{display}</math>'
+                   ) as convert:
+
+            for _ in range(2):
+                html = self.run_markdown(
+                    r'''
+                    Text1 $math0$ $math0$ $$math0$$ $math1$
+                    ''',
+                    math = 'mathml',
+                    cache = cache)
+
+                assert_that(
+                    [e.text for e in lxml_html.fromstring(html).iter('math')],
+                    contains_exactly('math0-inline', 'math0-inline', 'math0-block',
+                                     'math1-inline'))
+
+            # Only the first instance of each distinct snippet should have been converted.
+            self.assertEqual(convert.call_count, 3)
+
+
 
     def test_dependency_recognition(self):
 
@@ -1264,10 +1470,8 @@ class LatexTestCase(unittest.TestCase):
         with open(dependency_file, 'w') as f:
             f.write('1')
 
-        # The dependency file must be in the current directory (or, theoretically, the home dir),
-        # or else it won't be considered.
-        orig_cwd = os.getcwd()
-        os.chdir(self.tmp_dir)
+        # The dependency file must be in the base directory (or, theoretically, the home dir), or
+        # else it won't be considered.
 
         self.run_markdown(
             r'''
@@ -1275,7 +1479,8 @@ class LatexTestCase(unittest.TestCase):
             \end{document}
             ''',
             cache = cache,
-            live_update_deps = live_update_deps
+            live_update_deps = live_update_deps,
+            base_dir = self.tmp_dir
         )
 
         # Amend the mock compiler so that it creates 'flag_file' when run, so that we know _if_
@@ -1292,7 +1497,8 @@ class LatexTestCase(unittest.TestCase):
             \end{document}
             ''',
             cache = cache,
-            live_update_deps = live_update_deps
+            live_update_deps = live_update_deps,
+            base_dir = self.tmp_dir
         )
 
         self.assertFalse(os.path.exists(flag_file),
@@ -1306,14 +1512,13 @@ class LatexTestCase(unittest.TestCase):
             \end{document}
             ''',
             cache = cache,
-            live_update_deps = live_update_deps
+            live_update_deps = live_update_deps,
+            base_dir = self.tmp_dir
         )
 
         self.assertTrue(os.path.exists(flag_file),
                         'Tex _should_ be re-run when the dependency file changes')
 
-        os.chdir(orig_cwd)
-
 
     def test_extension_setup(self):
         assert_that(
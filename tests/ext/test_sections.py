@@ -1,4 +1,5 @@
-from ..util.markdown_ext import entry_point_cls
+from __future__ import annotations
+from ..util.markdown_ext import config_key, dedent_strip, entry_point_cls
 import unittest
 from unittest.mock import patch
 from hamcrest import assert_that, instance_of, is_, same_instance
@@ -8,19 +9,29 @@ import markdown
 
 import re
 import sys
-from textwrap import dedent
 
 sys.modules['la'] = sys.modules['lamarkdown.ext']
 
 
 class SectionsTestCase(unittest.TestCase):
 
+    # Markdown instances, shared between tests with identical configurations.
+    _md_cache: dict[tuple, markdown.Markdown] = {}
+
     def run_markdown(self, markdown_text, other_extensions = [], other_config = {}, **kwargs):
-        md = markdown.Markdown(
-            extensions = ['la.sections', *other_extensions],
-            extension_configs = {'la.sections': kwargs, **other_config}
-        )
-        return md.convert(dedent(markdown_text).strip())
+        key = config_key(other_extensions, other_config, **kwargs)
+        md = self._md_cache.get(key)
+        if md is None:
+            md = markdown.Markdown(
+                extensions = ['la.sections', *other_extensions],
+                extension_configs = {'la.sections': kwargs, **other_config}
+            )
+            if key is not None:
+                self._md_cache[key] = md
+        else:
+            md.reset()
+
+        return md.convert(dedent_strip(markdown_text))
 
 
     def test_basic_syntax(self):
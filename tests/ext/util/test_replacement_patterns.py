@@ -19,6 +19,11 @@ class ReplacementPatternsTestCase(unittest.TestCase):
             elem.text = match.group(1)
             return elem
 
+    class StartCharDollarPattern(DollarPattern):
+        def __init__(self):
+            super().__init__()
+            self.start_chars = '$'
+
     def test_single_pattern(self):
         for input_text, expected_html in [
             # Structural variations
@@ -104,17 +109,24 @@ class ReplacementPatternsTestCase(unittest.TestCase):
                 r'hello $`some$`$text`$ world',
                 r'hello <span x="1">`some</span><code>$text</code>$ world'
             ),
+            (
+                r'hello world `some` $text$',
+                r'hello world <code>some</code> <span x="1">text</span>'
+            ),
         ]:
-            md = markdown.Markdown()
-            html_block_processor.init(md)
+            # Patterns declaring their start characters should behave identically to those that
+            # don't.
+            for pattern_cls in [self.DollarPattern, self.StartCharDollarPattern]:
+                md = markdown.Markdown()
+                html_block_processor.init(md)
 
-            replacement_patterns.init(md)
-            md.ESCAPED_CHARS.append('$')
-            md.replacement_patterns.register(self.DollarPattern(), 'dollar', 10)
+                replacement_patterns.init(md)
+                md.ESCAPED_CHARS.append('$')
+                md.replacement_patterns.register(pattern_cls(), 'dollar', 10)
 
-            html = md.convert(input_text)
+                html = md.convert(input_text)
 
-            assert_that(html, contains_string(expected_html))
+                assert_that(html, contains_string(expected_html))
 
 
     def test_atomic_strings(self):
@@ -185,3 +197,21 @@ class ReplacementPatternsTestCase(unittest.TestCase):
 
             html = md.convert(input_text)
             assert_that(html, contains_string(expected_html))
+
+
+    def test_match_override(self):
+        class FilteredPattern(self.DollarPattern):
+            def match(self, text, pos):
+                # Only accept matches preceded by a space (or the start of the text).
+                if pos > 0 and text[pos - 1] != ' ':
+                    return None
+                return super().match(text, pos)
+
+        md = markdown.Markdown()
+        replacement_patterns.init(md)
+        md.replacement_patterns.register(FilteredPattern(), 'dollar', 10)
+
+        html = md.convert('hello $some text$ x$more text$ world')
+        assert_that(
+            html,
+            contains_string('hello <span x="1">some text</span> x$more text$ world'))
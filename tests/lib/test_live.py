@@ -6,384 +6,523 @@ import unittest
 from unittest.mock import patch
 
 from hamcrest import (assert_that, contains_exactly, empty, equal_to, has_key, is_not)
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-import selenium.webdriver.support.expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+import lxml.html
+from watchdog.observers.polling import PollingObserver
 
 import copy
+import json
 import os
+import socket
 import tempfile
 from textwrap import dedent
 import threading
-import time
+import urllib.error
 import urllib.request
 
 
+# Source and build file contents, written (and rewritten) by the tests.
+DOC_MD = dedent('''
+    # Doc Heading
+
+    Paragraph 1
+    {.class1}
+
+    Paragraph 2
+    {.class2}
+''')
+
+BUILD_A = dedent('''
+    import lamarkdown as la
+    la('attr_list')
+''')
+
+DOC_MD_B = dedent('''
+    # Doc Heading B
+
+    Paragraph 1
+    {.class1}
+
+    Paragraph 2
+    {.class2}
+''')
+
+BUILD_A_PRUNE = dedent('''
+    import lamarkdown as la
+    la('attr_list')
+    la.prune('.class1')
+''')
+
+BUILD_B = dedent('''
+    import lamarkdown as la
+    la('attr_list')
+    la.with_html(lambda html: html + '<p>Paragraph 3</p>')
+''')
+
+BUILD_A_VARIANTS = dedent('''
+    import lamarkdown as la
+    la('attr_list')
+
+    def VariantA(): la.prune('.class2')
+    def VariantB(): la.prune('.class1')
+
+    la.variants(VariantA, VariantB)
+''')
+
+BUILD_A_NESTED_VARIANTS = dedent('''
+    import lamarkdown as la
+    la('attr_list')
+
+    def VariantA1(): la.with_html(lambda html: html + '<div id="x">A1</div>')
+    def VariantA2(): la.with_html(lambda html: html + '<div id="x">A2</div>')
+    def VariantB1(): la.with_html(lambda html: html + '<div id="x">B1</div>')
+    def VariantB2(): la.with_html(lambda html: html + '<div id="x">B2</div>')
+    def VariantA(): la.variants(VariantA1, VariantA2)
+    def VariantB(): la.variants(VariantB1, VariantB2)
+
+    la.variants(VariantA, VariantB)
+''')
+
+# Extra (non-source) dependency files, relative to the temporary directory of each test.
+EXTRA_FILE_A = os.path.join('subdir_a', 'extra_a.txt')
+EXTRA_FILE_B = os.path.join('subdir_b', 'extra_b.txt')
+EXTRA_FILE_C = os.path.join('subdir_c', 'extra_c.txt')
+
+# Where to create temporary directories. Where available, we use a RAM-backed (tmpfs) filesystem,
+# since the tests spend much of their time writing, renaming and deleting files.
+TMP_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def free_port():
+    '''
+    Finds a currently-unused port, by letting the OS pick one, so that tests (possibly running in
+    parallel) don't contend for fixed port numbers.
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
 
 class LiveTestCase(unittest.TestCase):
 
-    def setUp(self):
-        self.orig_dir = os.getcwd()
+    def make_tmp_dir(self):
+        '''
+        Creates a temporary directory, deleted at the end of the test. We use absolute paths within
+        it, rather than changing the (process-wide) current directory.
+        '''
+        tmp_dir_context = tempfile.TemporaryDirectory(dir = TMP_ROOT)
+        self.tmp_dir = tmp_dir_context.__enter__()
+        self.addCleanup(tmp_dir_context.__exit__, None, None, None)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp_dir, *parts)
+
+    def make_build_params(self, **overrides):
+        '''
+        Creates live-mode build parameters for 'doc.md' in the temporary directory, with mock
+        caches and progress reporting. Keyword arguments override the defaults.
+        '''
+        progress = MockProgress()
+        return build_params.BuildParams(**{
+            'src_file':             self.path('doc.md'),
+            'target_file':          self.path('doc.html'),
+            'build_files':          [],
+            'build_dir':            self.path('build'),
+            'build_defaults':       True,
+            'build_cache':          MockCache(),
+            'fetch_cache':          MockCache(),
+            'progress':             progress,
+            'directives':           directives.Directives(progress),
+            'is_live':              True,
+            'allow_exec_cmdline':   False,
+            **overrides
+        })
+
+
+    def start_live_session(self):
+        '''
+        Sets up a source document and build file in a fresh temporary directory, starts a live
+        updater for them on a free port, and loads the resulting page.
+        '''
+        port = free_port()
+        self.update_n = 0
+
+        self.make_tmp_dir()
+
+        with open(self.path('doc.md'), 'w') as f:
+            f.write(DOC_MD)
+
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A)
+
+        os.mkdir(self.path('subdir_a'))
+        os.mkdir(self.path('subdir_b'))
+        with open(self.path(EXTRA_FILE_A), 'w') as f:
+            f.write('A')
+
+        base_build_params = self.make_build_params(
+            build_files = [self.path('build_a.py'), self.path('build_b.py')],
+            live_update_deps = {self.path(EXTRA_FILE_A),
+                                self.path(EXTRA_FILE_B),
+                                self.path(EXTRA_FILE_C)}
+        )
+        self.build_cache = base_build_params.build_cache
+        self.fetch_cache = base_build_params.fetch_cache
+        self.complete_build_params = md_compiler.compile(base_build_params)
+
+        self.updater = updater = live.LiveUpdater(base_build_params, self.complete_build_params)
+
+        # A short poll interval lets shutdown() (at the end of each test) return quickly.
+        threading.Thread(
+            target = lambda: updater.run(address = '127.0.0.1',
+                                         port_range = range(port, port + 1),
+                                         launch_browser = False,
+                                         poll_interval = 0.05),
+        ).start()
+
+        # The server starts up asynchronously, so wait until it's ready before we query it.
+        self.assertTrue(updater.wait_for_server(timeout = 2), 'Server failed to start')
+        self.addCleanup(updater.shutdown)
+
+        self.url = f'http://127.0.0.1:{port}'
+        self.load()
+
+        assert_that(self.find_attr('title', 'textContent'), contains_exactly('Doc Heading'))
+        assert_that(self.find_attr('h1', 'textContent'),    contains_exactly('Doc Heading'))
+        assert_that(
+            self.find_attr('p', 'textContent'),
+            contains_exactly('Paragraph 1', 'Paragraph 2')
+        )
+        assert_that(self.find_attr(f'#{live.CONTROL_PANEL_ID}', 'data-update-n'),
+                    contains_exactly('0'))
+
+
+    def load(self, url = None):
+        '''
+        Fetches and parses a page from the server (by default, the root page), for subsequent
+        find_attr() calls. This is much faster than going through a browser, and sufficient for
+        checking the page content.
+        '''
+        url = url or self.url
+        with urllib.request.urlopen(url) as conn:
+            self.page = lxml.html.document_fromstring(conn.read(), base_url = url)
+        self.page.make_links_absolute()
+
+
+    def find_attr(self, selector, attr):
+        return [elem.text_content() if attr == 'textContent' else elem.get(attr)
+                for elem in self.page.cssselect(selector)]
+
+
+    def wait_for_update(self, msg, timeout_secs = 2):
+        '''
+        Waits for an update beyond the last one we observed, and then reloads the root page.
+
+        We don't predict the exact update number, so an extra update (e.g., from a doubled-up file
+        event) can't throw the rest of the test out of sync. And rather than polling, we block
+        until the updater signals that it's done.
+        '''
+        if not self.updater.wait_for_update(self.update_n, timeout_secs):
+            raise AssertionError(
+                f'Timeout - document not refreshed after {timeout_secs} seconds: {msg}')
+
+        # Find out the new update number the way the page's own script does.
+        with urllib.request.urlopen(f'{self.url}{live.QUERY_PATH}') as conn:
+            self.update_n = json.load(conn)['update_n']
+        self.load()
+
+
+    @patch('lamarkdown.lib.resources.read_url')
+    def test_watch_live_dependencies(self, mock_read_url):
+        mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
+
+        with open(self.path('doc.md'), 'w') as f:
+            f.write(DOC_MD_B)
+
+        self.wait_for_update('Modified doc.md')
+        assert_that(self.find_attr('title', 'textContent'), contains_exactly('Doc Heading B'))
+        assert_that(self.find_attr('h1',    'textContent'), contains_exactly('Doc Heading B'))
+
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A_PRUNE)
+
+        self.wait_for_update('Modified build_a.py')
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 2'))
+
+        with open(self.path('build_b.py'), 'w') as f:
+            f.write(BUILD_B)
+
+        self.wait_for_update('Added new build_b.py')
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 2',
+                                                                         'Paragraph 3'))
+
+        os.remove(self.path('build_a.py'))
+        self.wait_for_update('Deleted build_a.py')
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
+                                                                         'Paragraph 2',
+                                                                         'Paragraph 3'))
+
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A)
+        self.wait_for_update('Added new build_a.py')
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
+                                                                         'Paragraph 2',
+                                                                         'Paragraph 3'))
+
+        os.remove(self.path('build_b.py'))
+        self.wait_for_update('Deleted build_b.py')
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
+                                                                         'Paragraph 2'))
+
+        # Modifying/creating extra dependency files
+        #
+        # From here on, we only touch files that don't affect the output, and we only care that
+        # each change triggers an update. Hence, rather than actually recompiling each time, the
+        # updater gets the (unchanged) build parameters from the first compile.
+
+        with patch('lamarkdown.lib.md_compiler.compile',
+                   return_value = self.complete_build_params):
+
+            with open(self.path(EXTRA_FILE_A), 'w') as f:
+                f.write('AA')
+
+            self.wait_for_update(f'Modified {EXTRA_FILE_A}')
+
+            with open(self.path(EXTRA_FILE_B), 'w') as f:
+                f.write('BB')
+
+            self.wait_for_update(f'Added new {EXTRA_FILE_B}')
+
+            os.mkdir(self.path('subdir_c'))
+            with open(self.path(EXTRA_FILE_C), 'w') as f:
+                f.write('CC')
+
+            self.wait_for_update(f'Added new {EXTRA_FILE_C} (including directory creation)')
+
+            # Moving files and directories
+
+            os.rename(self.path(EXTRA_FILE_A), self.path(EXTRA_FILE_A + '1'))
+            self.wait_for_update(f'Renamed {EXTRA_FILE_A} to {EXTRA_FILE_A}1')
+
+            os.rename(self.path(EXTRA_FILE_B), self.path('subdir_a', 'extra_b.txt'))
+            self.wait_for_update(f'Moved {EXTRA_FILE_B} to subdir_a/ (monitored)')
+
+            os.mkdir(self.path('subdir_d'))
+            os.rename(self.path(EXTRA_FILE_C), self.path('subdir_d', 'extra_c.txt'))
+            self.wait_for_update(f'Moved {EXTRA_FILE_C} to subdir_d/ (unmonitored)')
+
+            # Restore one of the files, so we can see what happens when we rename the whole
+            # parent directory
+            with open(self.path(EXTRA_FILE_A), 'w') as f:
+                f.write('AA')
+            self.wait_for_update(f'Restored {EXTRA_FILE_A}')
+            os.rename(self.path('subdir_a'), self.path('subdir_a1'))
+            self.wait_for_update('Renamed subdir_a/ to subdir_a1/')
+
+
+    @patch('lamarkdown.lib.resources.read_url')
+    def test_watch_live_unchanged(self, mock_read_url):
+        mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
+
+        with patch('lamarkdown.lib.md_compiler.compile',
+                   wraps = md_compiler.compile) as mock_compile:
+
+            with open(self.path('doc.md'), 'w') as f:
+                f.write(DOC_MD)
+
+            self.wait_for_update('Re-saved doc.md without changes')
+            mock_compile.assert_not_called()
+            assert_that(self.find_attr('h1', 'textContent'), contains_exactly('Doc Heading'))
+
+            # Directory events always recompile, even though no known dependency has changed.
+            os.mkdir(self.path('subdir_c'))
+
+            self.wait_for_update('Created subdir_c/')
+            mock_compile.assert_called_once()
+
+            with open(self.path('doc.md'), 'w') as f:
+                f.write(DOC_MD_B)
+
+            self.wait_for_update('Modified doc.md')
+            assert_that(mock_compile.call_count, equal_to(2))
+            assert_that(self.find_attr('h1', 'textContent'), contains_exactly('Doc Heading B'))
+
+
+    @patch('lamarkdown.lib.resources.read_url')
+    def test_watch_live_unchanged_new_dependency(self, mock_read_url):
+        mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
+
+        with open(self.path('extra_d.txt'), 'w') as f:
+            f.write('D')
+
+        # A build file that adds to the set of dependencies.
+        build_a_extra_dep = BUILD_A + dedent(f'''
+            la.params.live_update_deps.add({self.path('extra_d.txt')!r})
+        ''')
+
+        with patch('lamarkdown.lib.md_compiler.compile',
+                   wraps = md_compiler.compile) as mock_compile:
+
+            with open(self.path('build_a.py'), 'w') as f:
+                f.write(build_a_extra_dep)
+
+            self.wait_for_update('Modified build_a.py to add a dependency')
+            mock_compile.assert_called_once()
 
-    def tearDown(self):
-        os.chdir(self.orig_dir)
+            # Now that the dependencies have changed, an unmodified re-save should still be
+            # recognised as such.
+            with open(self.path('build_a.py'), 'w') as f:
+                f.write(build_a_extra_dep)
+
+            self.wait_for_update('Re-saved build_a.py without changes')
+            mock_compile.assert_called_once()
+
+            with open(self.path('extra_d.txt'), 'w') as f:
+                f.write('DD')
+
+            self.wait_for_update('Modified new dependency extra_d.txt')
+            assert_that(mock_compile.call_count, equal_to(2))
 
 
     @patch('lamarkdown.lib.resources.read_url')
-    def test_watch_live(self, mock_read_url):
+    def test_watch_live_variants(self, mock_read_url):
         mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
 
-        with tempfile.TemporaryDirectory() as dir:
-            os.chdir(dir)
-
-            browser_opts = webdriver.firefox.options.Options()
-            browser_opts.add_argument('--headless')
-            browser = webdriver.Firefox(options = browser_opts)
-            update_n = [0]  # Singleton list, just to let wait_for_update() modify the value
-
-            def find_attr(selector, attr):
-                return [elem.get_attribute(attr)
-                        for elem in browser.find_elements(By.CSS_SELECTOR, selector)]
-
-            def wait_for_update(msg, timeout_secs = 2):
-                update_n[0] += 1
-
-                try:
-                    WebDriverWait(browser, timeout_secs).until(
-                        EC.text_to_be_present_in_element_attribute(
-                            (By.CSS_SELECTOR, f'#{live.CONTROL_PANEL_ID}'),
-                            'data-update-n',
-                            str(update_n[0])))
-                except TimeoutException as e:
-                    raise AssertionError(
-                        f'Timeout - document not refreshed after {timeout_secs} seconds: {msg}'
-                    ) from e
-
-            with open('doc.md', 'w') as f:
-                f.write(dedent('''
-                    # Doc Heading
-
-                    Paragraph 1
-                    {.class1}
-
-                    Paragraph 2
-                    {.class2}
-                '''))
-
-            with open('build_a.py', 'w') as f:
-                f.write(dedent('''
-                    import lamarkdown as la
-                    la('attr_list')
-                '''))
-
-            extra_file_a = os.path.join('subdir_a', 'extra_a.txt')
-            extra_file_b = os.path.join('subdir_b', 'extra_b.txt')
-            extra_file_c = os.path.join('subdir_c', 'extra_c.txt')
-
-            os.mkdir('subdir_a')
-            os.mkdir('subdir_b')
-            with open(extra_file_a, 'w') as f:
-                f.write('A')
-
-
-            build_cache = MockCache()
-            fetch_cache = MockCache()
-            progress = MockProgress()
-            base_build_params = build_params.BuildParams(
-                src_file = 'doc.md',
-                target_file = 'doc.html',
-                build_files = ['build_a.py', 'build_b.py'],
-                build_dir = 'build',
-                build_defaults = True,
-                build_cache = build_cache,
-                fetch_cache = fetch_cache,
-                progress = progress,
-                directives = directives.Directives(progress),
-                is_live = True,
-                allow_exec_cmdline = False,
-                live_update_deps = {extra_file_a, extra_file_b, extra_file_c}
-            )
-            complete_build_params = md_compiler.compile(base_build_params)
-
-            updater = live.LiveUpdater(base_build_params, complete_build_params)
-
-            threading.Thread(
-                target = lambda: updater.run(address = '127.0.0.1',
-                                             port_range = range(14100, 14101),
-                                             launch_browser = False),
-            ).start()
-
-            # The server needs a bit of time to start up (asynchronously) before we query it.
-            time.sleep(0.5)
-
-            try:
-                browser.get('http://127.0.0.1:14100')
-
-                assert_that(find_attr('title', 'textContent'), contains_exactly('Doc Heading'))
-                assert_that(find_attr('h1', 'textContent'),    contains_exactly('Doc Heading'))
-                assert_that(
-                    find_attr('p', 'textContent'),
-                    contains_exactly('Paragraph 1', 'Paragraph 2')
-                )
-                assert_that(find_attr(f'#{live.CONTROL_PANEL_ID}', 'data-update-n'), '0')
-
-
-                # Test dependencies
-                # -----------------
-
-                with open('doc.md', 'w') as f:
-                    f.write(dedent('''
-                        # Doc Heading B
-
-                        Paragraph 1
-                        {.class1}
-
-                        Paragraph 2
-                        {.class2}
-                    '''))
-
-                wait_for_update('Modified doc.md')
-                assert_that(find_attr('title', 'textContent'), contains_exactly('Doc Heading B'))
-                assert_that(find_attr('h1',    'textContent'), contains_exactly('Doc Heading B'))
-
-                with open('build_a.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-                        la.prune('.class1')
-                    '''))
-
-                wait_for_update('Modified build_a.py')
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 2'))
-
-                with open('build_b.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-                        la.with_html(lambda html: html + '<p>Paragraph 3</p>')
-                    '''))
-
-                wait_for_update('Added new build_b.py')
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 2',
-                                                                            'Paragraph 3'))
-
-                os.remove('build_a.py')
-                wait_for_update('Deleted build_a.py')
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
-                                                                            'Paragraph 2',
-                                                                            'Paragraph 3'))
-
-                with open('build_a.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-                    '''))
-                wait_for_update('Added new build_a.py')
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
-                                                                            'Paragraph 2',
-                                                                            'Paragraph 3'))
-
-                os.remove('build_b.py')
-                wait_for_update('Deleted build_b.py')
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
-                                                                            'Paragraph 2'))
-
-                # Modifying/creating extra dependency files
-
-                with open(extra_file_a, 'w') as f:
-                    f.write('AA')
-
-                wait_for_update(f'Modified {extra_file_a}')
-
-                with open(extra_file_b, 'w') as f:
-                    f.write('BB')
-
-                wait_for_update(f'Added new {extra_file_b}')
-
-                os.mkdir('subdir_c')
-                with open(extra_file_c, 'w') as f:
-                    f.write('CC')
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A_VARIANTS)
 
-                wait_for_update(f'Added new {extra_file_c} (including directory creation)')
-
-                # Moving files and directories
-
-                os.rename(extra_file_a, extra_file_a + '1')
-                wait_for_update(f'Renamed {extra_file_a} to {extra_file_a}1')
-
-                os.rename(extra_file_b, os.path.join('subdir_a', 'extra_b.txt'))
-                wait_for_update(f'Moved {extra_file_b} to subdir_a/ (monitored)')
-
-                os.mkdir('subdir_d')
-                os.rename(extra_file_c, os.path.join('subdir_d', 'extra_c.txt'))
-                wait_for_update(f'Moved {extra_file_c} to subdir_d/ (unmonitored)')
-
-                # Restore one of the files, so we can see what happens when we rename the whole
-                # parent directory
-                with open(extra_file_a, 'w') as f:
-                    f.write('AA')
-                wait_for_update(f'Restored {extra_file_a}')
-                os.rename('subdir_a', 'subdir_a1')
-                wait_for_update('Renamed subdir_a/ to subdir_a1/')
 
+        self.wait_for_update('Modified build_a.py to specify VariantA and VariantB')
 
-                # Test variants
-                # -------------
-
-                with open('build_a.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-
-                        def VariantA(): la.prune('.class2')
-                        def VariantB(): la.prune('.class1')
-
-                        la.variants(VariantA, VariantB)
-                    '''))
-
-
-                wait_for_update('Modified build_a.py to specify VariantA and VariantB')
-
-                urls = find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href')
-                assert_that(
-                    urls,
-                    contains_exactly('http://127.0.0.1:14100/VariantA/index.html',
-                                     'http://127.0.0.1:14100/VariantB/index.html')
-                )
-
-                browser.get(urls[0])
-                assert_that(find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), equal_to(urls))
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 1'))
-
-                browser.get(urls[1])
-                assert_that(find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), equal_to(urls))
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 2'))
-
-                with open('build_a.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-
-                        def VariantA1(): la.with_html(lambda html: html + '<div id="x">A1</div>')
-                        def VariantA2(): la.with_html(lambda html: html + '<div id="x">A2</div>')
-                        def VariantB1(): la.with_html(lambda html: html + '<div id="x">B1</div>')
-                        def VariantB2(): la.with_html(lambda html: html + '<div id="x">B2</div>')
-                        def VariantA(): la.variants(VariantA1, VariantA2)
-                        def VariantB(): la.variants(VariantB1, VariantB2)
+        urls = self.find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href')
+        assert_that(
+            urls,
+            contains_exactly(f'{self.url}/VariantA/index.html',
+                             f'{self.url}/VariantB/index.html')
+        )
 
-                        la.variants(VariantA, VariantB)
-                    '''))
+        self.load(urls[0])
+        assert_that(self.find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), equal_to(urls))
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 1'))
 
-                wait_for_update(
-                    'Modified build_a.py to specify variants A and B, '
-                    'with sub-variants A1, A2, B1 and B2')
+        self.load(urls[1])
+        assert_that(self.find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), equal_to(urls))
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 2'))
 
-                urls = find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href')
-                assert_that(
-                    urls,
-                    contains_exactly('http://127.0.0.1:14100/VariantA1/index.html',
-                                     'http://127.0.0.1:14100/VariantA2/index.html',
-                                     'http://127.0.0.1:14100/VariantB1/index.html',
-                                     'http://127.0.0.1:14100/VariantB2/index.html')
-                )
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A_NESTED_VARIANTS)
 
-                for i, name in enumerate(['A1', 'A2', 'B1', 'B2']):
-                    browser.get(urls[i])
-                    assert_that(find_attr('div#x', 'textContent'), contains_exactly(name))
+        self.wait_for_update(
+            'Modified build_a.py to specify variants A and B, '
+            'with sub-variants A1, A2, B1 and B2')
 
-                with open('build_a.py', 'w') as f:
-                    f.write(dedent('''
-                        import lamarkdown as la
-                        la('attr_list')
-                    '''))
+        urls = self.find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href')
+        assert_that(
+            urls,
+            contains_exactly(f'{self.url}/VariantA1/index.html',
+                             f'{self.url}/VariantA2/index.html',
+                             f'{self.url}/VariantB1/index.html',
+                             f'{self.url}/VariantB2/index.html')
+        )
 
-                wait_for_update('Modified build_a.py to revert to no variants')
-                assert_that(find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), empty())
-                assert_that(find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
-                                                                            'Paragraph 2'))
-                assert_that(find_attr('div#x', 'textContent'), empty())
+        for i, name in enumerate(['A1', 'A2', 'B1', 'B2']):
+            self.load(urls[i])
+            assert_that(self.find_attr('div#x', 'textContent'), contains_exactly(name))
 
+        with open(self.path('build_a.py'), 'w') as f:
+            f.write(BUILD_A)
+
+        self.wait_for_update('Modified build_a.py to revert to no variants')
+        assert_that(self.find_attr(f'#{live.CONTROL_PANEL_ID} a', 'href'), empty())
+        assert_that(self.find_attr('p', 'textContent'), contains_exactly('Paragraph 1',
+                                                                         'Paragraph 2'))
+        assert_that(self.find_attr('div#x', 'textContent'), empty())
 
-                # Clean builds
-                # ------------
-
-                build_cache['mock_key'] = 'mock_value'
-                fetch_cache['mock_key'] = 'mock_value'
-                browser.find_element(By.CSS_SELECTOR,
-                                     f'#{live.CONTROL_PANEL_CLEAN_BUTTON_ID}').click()
-                wait_for_update('Clean build')
-                assert_that(build_cache, is_not(has_key('mock_key')))
-                assert_that(fetch_cache, has_key('mock_key'))
-
-            finally:
-                browser.quit()
-                updater.shutdown()
 
+    @patch('lamarkdown.lib.resources.read_url')
+    def test_watch_live_clean_build(self, mock_read_url):
+        mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
+
+        self.build_cache['mock_key'] = 'mock_value'
+        self.fetch_cache['mock_key'] = 'mock_value'
+
+        with patch('lamarkdown.lib.md_compiler.compile',
+                   wraps = md_compiler.compile) as mock_compile:
+
+            # Make the same request as the page's "Clean Build" button.
+            request = urllib.request.Request(f'{self.url}{live.CLEAN_BUILD_PATH}', method = 'POST')
+            with urllib.request.urlopen(request) as conn:
+                assert_that(conn.read().decode(), equal_to(live.POST_RESPONSE))
+
+            self.wait_for_update('Clean build')
+
+            # Nothing has changed, but a clean build always recompiles.
+            mock_compile.assert_called_once()
+
+        assert_that(self.build_cache, is_not(has_key('mock_key')))
+        assert_that(self.fetch_cache, has_key('mock_key'))
+
+
+    def test_native_observer(self):
+        # Polling would delay every update by up to the polling interval.
+        assert_that(issubclass(live.OBSERVER_CLASS, PollingObserver), equal_to(False))
+
+
+    @patch('lamarkdown.lib.live.OBSERVER_CLASS')
     @patch('lamarkdown.lib.resources.read_url')
     @patch('lamarkdown.lib.md_compiler.compile')
-    def test_404(self, mock_compile, mock_read_url):
+    def test_404(self, mock_compile, mock_read_url, mock_observer):
         mock_read_url.return_value = (False, b'', None)
 
-        with tempfile.TemporaryDirectory() as dir:
-            os.chdir(dir)
-
-            with open('doc.md', 'w') as f:
-                f.write('Mock markdown')
-
-            with open('doc.html', 'w') as f:
-                f.write('<div>Mock HTML</div>')
-
-            progress = MockProgress()
-            base_build_params = build_params.BuildParams(
-                src_file = 'doc.md',
-                target_file = 'doc.html',
-                build_files = [],
-                build_dir = 'build',
-                build_defaults = True,
-                build_cache = MockCache(),
-                fetch_cache = MockCache(),
-                progress = progress,
-                directives = directives.Directives(progress),
-                is_live = True,
-                allow_exec_cmdline = False,
-            )
-
-            updater = live.LiveUpdater(base_build_params, [copy.copy(base_build_params)])
-
-            threading.Thread(
-                target = lambda: updater.run(address = '127.0.0.1',
-                                             port_range = range(14100, 14101),
-                                             launch_browser = False),
-            ).start()
-
-            def load(path):
-                with urllib.request.urlopen(f'http://127.0.0.1:14100/{path}') as conn:
-                    return (conn.status, conn.read())
-
-            try:
-                time.sleep(0.1)  # Wait for server to come up
-
-                from urllib.request import HTTPError as Err
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/index.html')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/doesntexist')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/doesntexist/doesntexist')
-
-                new_complete_build_params = [copy.copy(base_build_params)]
-                new_complete_build_params[0].name = 'new_name'
-                mock_compile.return_value = new_complete_build_params
-
-                # Trigger recompile
-                with open('doc.md', 'w') as f:
-                    f.write('Mock markdown!')
-                time.sleep(0.1)  # Wait for updater to recompile
-
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/index.html')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/doesntexist')
-                self.assertRaisesRegex(Err, '404', load, 'doesntexist/doesntexist/doesntexist')
-
-            finally:
-                updater.shutdown()
+        self.make_tmp_dir()
+
+        with open(self.path('doc.md'), 'w') as f:
+            f.write('Mock markdown')
+
+        with open(self.path('doc.html'), 'w') as f:
+            f.write('<div>Mock HTML</div>')
+
+        base_build_params = self.make_build_params()
+
+        # We query the updater directly, rather than through a server. (test_404_http covers the
+        # HTTP side of things.)
+        updater = live.LiveUpdater(base_build_params, [copy.copy(base_build_params)])
+        updater.read_and_instrument()
+        updater.watch_dependencies()
+
+        paths = ['/doesntexist',
+                 '/doesntexist/index.html',
+                 '/doesntexist/doesntexist',
+                 '/doesntexist/doesntexist/doesntexist']
+
+        for path in paths:
+            assert_that(updater.handle_path(path), equal_to(live.NOT_FOUND), path)
+
+        new_complete_build_params = [copy.copy(base_build_params)]
+        new_complete_build_params[0].name = 'new_name'
+        mock_compile.return_value = new_complete_build_params
+
+        with open(self.path('doc.md'), 'w') as f:
+            f.write('Mock markdown!')
+        updater.recompile()
+        mock_compile.assert_called_once()
+
+        for path in paths:
+            assert_that(updater.handle_path(path), equal_to(live.NOT_FOUND), path)
+
+
+    @patch('lamarkdown.lib.resources.read_url')
+    def test_404_http(self, mock_read_url):
+        mock_read_url.return_value = (False, b'', None)
+        self.start_live_session()
+
+        for method in ['GET', 'POST']:
+            request = urllib.request.Request(f'{self.url}/doesntexist', method = method)
+            with self.assertRaises(urllib.error.HTTPError, msg = method) as cm:
+                urllib.request.urlopen(request)
+            assert_that(cm.exception.code, equal_to(404), method)
+            cm.exception.close()
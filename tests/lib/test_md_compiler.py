@@ -8,16 +8,60 @@ from hamcrest import (assert_that, contains_exactly, contains_string, empty,
                       equal_to_ignoring_whitespace, has_entries, has_items, instance_of, is_,
                       is_not, matches_regexp, not_, only_contains, same_instance)
 
-import lxml
+import lxml.etree
+import lxml.html
 import cssutils
 
 import base64
 import collections
 import mimetypes
 import os
+import re
 import tempfile
 from textwrap import dedent
 
+# XPath expressions used by several tests, compiled once up front.
+XPATH_STYLE_TEXT  = lxml.etree.XPath('/html/head/style/text()')
+XPATH_SCRIPT_TEXT = lxml.etree.XPath('/html/body/script/text()')
+XPATH_TITLE_TEXT  = lxml.etree.XPath('/html/head/title/text()')
+XPATH_H1_TEXT     = lxml.etree.XPath('//h1/text()')
+XPATH_P_TEXT      = lxml.etree.XPath('//p/text()')
+XPATH_IMG_SRC     = lxml.etree.XPath('//img/@src')
+XPATH_AUDIO_SRC   = lxml.etree.XPath('//audio/@src')
+
+# Parameterised XPath expressions (with values supplied at evaluation time).
+XPATH_STYLESHEET_LINK_COUNT = lxml.etree.XPath(
+    'count(/html/head/link[@rel="stylesheet"][@href=$href])')
+XPATH_SCRIPT_AFTER_P_COUNT = lxml.etree.XPath(
+    'count(/html/body/p/following-sibling::script[@src=$src])')
+XPATH_WIDTH  = lxml.etree.XPath('//*[name()=$tag][@id=$id]/@width')
+XPATH_HEIGHT = lxml.etree.XPath('//*[name()=$tag][@id=$id]/@height')
+
+# Expected <body> structures, compiled once up front.
+BASIC_BODY_REGEX = re.compile(r'''(?x)
+    \s* <body>
+    \s* <h1> Heading </h1>
+    \s* <p> Paragraph1 </p>
+    \s* </body>
+    \s*
+''')
+
+EXTENSIONS_BODY_REGEX = re.compile(r'''(?x)
+    \s* <body>
+    \s* <h1[ ]id="testid"> Heading </h1>
+    \s* <p> Paragraph \s* <abbr[ ]title="description"> PARA </abbr> </p>
+    \s* </body>
+    \s*
+''')
+
+EXTENSION_CONFIG_BODY_REGEX = re.compile(r'''(?x)
+    \s* <body>
+    \s* <h1> Heading... </h1>
+    \s* <p> "Paragraph" [ ] (&mdash;|—) [ ] (&laquo;|«) Text (&raquo;|») </p>
+    \s* </body>
+    \s*
+''')
+
 # TODO: also test these API properties:
 # - css_vars
 # - build_dir
@@ -31,21 +75,43 @@ class MdCompilerTestCase(unittest.TestCase):
     def setUpClass(cls):
         cssutils.log.setLevel('CRITICAL')
 
+        # The parsers hold no per-document state, so the tests can all share them.
+        #
+        # We only compare the (normalised) CSS text, which validation doesn't affect; validating
+        # property values would just cost time and produce (suppressed) log messages.
+        cls.css_parser = cssutils.CSSParser(
+            parseComments = False,
+            validate = False
+        )
+        cls.html_parsers = {
+            recover: lxml.html.HTMLParser(
+                recover = recover,  # Accept (according to lxml/libxml) broken HTML?
+                no_network = True,  # Don't load remote resources
+            )
+            for recover in [False, True]
+        }
+
+        # One temporary directory for the whole class, deleted at the end. Each test gets its own
+        # subdirectory, so that tests still can't see each other's files.
+        cls.tmp_dir_context = tempfile.TemporaryDirectory()
+        cls.class_tmp_dir = cls.tmp_dir_context.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir_context.__exit__(None, None, None)
+
     def setUp(self):
-        self.tmp_dir_context = tempfile.TemporaryDirectory()
-        self.tmp_dir = self.tmp_dir_context.__enter__()
-        self.html_file = os.path.join(self.tmp_dir, 'testdoc.html')
+        self.tmp_dir = os.path.join(self.class_tmp_dir, self._testMethodName)
+        os.mkdir(self.tmp_dir)
+        self.doc_file   = os.path.join(self.tmp_dir, 'testdoc.md')
+        self.build_file = os.path.join(self.tmp_dir, 'testbuild.py')
+        self.build_dir  = os.path.join(self.tmp_dir, 'build')
+        self.html_file  = os.path.join(self.tmp_dir, 'testdoc.html')
         self.orig_dir = os.getcwd()
         os.chdir(self.tmp_dir)
 
-        self.css_parser = cssutils.CSSParser(
-            parseComments = False,
-            validate = True
-        )
-
 
     def tearDown(self):
-        self.tmp_dir_context.__exit__(None, None, None)
         os.chdir(self.orig_dir)
 
 
@@ -54,16 +120,24 @@ class MdCompilerTestCase(unittest.TestCase):
         # with XPath expressions.
         self.root = lxml.html.parse(html_file, html_parser)
 
-        # Now find and parse the CSS code, if any:
-        self.css_sheets = [self.css_parser.parseString(t)
-                           for t in self.root.xpath('/html/head/style/text()')]
 
-        self.full_html = lxml.html.tostring(self.root, with_tail = False, encoding = 'unicode')
+    @property
+    def css_sheets(self):
+        # Likewise, only some tests look at the CSS code, so we find and parse it on demand.
+        return [self.css_parser.parseString(t) for t in XPATH_STYLE_TEXT(self.root)]
+
+
+    @property
+    def full_html(self):
+        # The serialised HTML is only needed by some tests, so we produce it on demand.
+        return lxml.html.tostring(self.root, with_tail = False, encoding = 'utf-8').decode()
 
+    @property
+    def body_html(self):
         # We probably want to just check the whole <body> element at once though.
-        self.body_html = lxml.html.tostring(self.root.find('body'),
-                                            with_tail = False,
-                                            encoding = 'unicode')
+        return lxml.html.tostring(self.root.find('body'),
+                                  with_tail = False,
+                                  encoding = 'utf-8').decode()
 
 
     def run_md_compiler(self,
@@ -73,9 +147,9 @@ class MdCompilerTestCase(unittest.TestCase):
                         is_live = False,
                         recover = False):
 
-        doc_file   = os.path.join(self.tmp_dir, 'testdoc.md')
-        build_file = os.path.join(self.tmp_dir, 'testbuild.py')
-        build_dir  = os.path.join(self.tmp_dir, 'build')
+        doc_file   = self.doc_file
+        build_file = self.build_file
+        build_dir  = self.build_dir
 
         with open(doc_file, 'w') as writer:
             writer.write(dedent(markdown))
@@ -135,13 +209,7 @@ class MdCompilerTestCase(unittest.TestCase):
                     f'build_params[{i}].{prop}'
                 )
 
-        self.set_results(
-            self.html_file,
-            lxml.html.HTMLParser(
-                recover = recover,  # Accept (according to lxml/libxml) broken HTML?
-                no_network = True,  # Don't load remote resources
-            )
-        )
+        self.set_results(self.html_file, self.html_parsers[recover])
 
 
     def test_basic(self):
@@ -160,21 +228,13 @@ class MdCompilerTestCase(unittest.TestCase):
 
         # The title should be taken from the <h1> element.
         assert_that(
-            self.root.xpath('/html/head/title/text()'),
+            XPATH_TITLE_TEXT(self.root),
             contains_exactly('Heading'))
 
         # Check the document structure.
         assert_that(
             self.body_html,
-            matches_regexp(
-                r'''(?x)
-                \s* <body>
-                \s* <h1> Heading </h1>
-                \s* <p> Paragraph1 </p>
-                \s* </body>
-                \s*
-                '''
-            )
+            matches_regexp(BASIC_BODY_REGEX)
         )
 
 
@@ -197,11 +257,11 @@ class MdCompilerTestCase(unittest.TestCase):
             ''')
 
         assert_that(
-            self.root.xpath('//h1/text()'),
+            XPATH_H1_TEXT(self.root),
             contains_exactly('Heading'))
 
         assert_that(
-            self.root.xpath('//p/text()'),
+            XPATH_P_TEXT(self.root),
             contains_exactly('Paragraph1'))
 
 
@@ -223,7 +283,7 @@ class MdCompilerTestCase(unittest.TestCase):
         ]:
             self.run_md_compiler(md, build = build, build_defaults = False)
             assert_that(
-                self.root.xpath('/html/head/title/text()'),
+                XPATH_TITLE_TEXT(self.root),
                 contains_exactly('The Title'))
 
         # Cases resulting in a default title (due to omission or ambiguity)
@@ -239,7 +299,7 @@ class MdCompilerTestCase(unittest.TestCase):
         ]:
             self.run_md_compiler(md, build = build, build_defaults = False)
             assert_that(
-                self.root.xpath('/html/head/title/text()'),
+                XPATH_TITLE_TEXT(self.root),
                 contains_exactly('testdoc'))
 
         # Cases resulting in title suppression
@@ -325,7 +385,7 @@ class MdCompilerTestCase(unittest.TestCase):
         )
 
         assert_that(
-            self.root.xpath('/html/head/style/text()')[0],
+            XPATH_STYLE_TEXT(self.root)[0],
             is_not(matches_regexp(r'[^"]/\*|\*/[^"]'))
         )
 
@@ -357,7 +417,7 @@ class MdCompilerTestCase(unittest.TestCase):
         ''')
 
         assert_that(
-            self.root.xpath('/html/body/script/text()')[0].strip(),
+            XPATH_SCRIPT_TEXT(self.root)[0].strip(),
             is_(expected_js.strip()))
 
 
@@ -376,30 +436,31 @@ class MdCompilerTestCase(unittest.TestCase):
             'la.embed(lambda mime, **k: mime not in ["text/css", "application/javascript"])',
             'la.embed(lambda tag,  **k: tag not in ["style", "script"])'
         ]:
-            self.run_md_compiler(
-                markdown = r'''
-                    # Heading
-
-                    Paragraph1
-                    ''',
-                build = fr'''
-                    import lamarkdown as la
-                    {code}
-                    la.css_files("cssfile.css")
-                    la.js_files("jsfile.js")
-                    ''',
-                build_defaults = False
-            )
+            with self.subTest(code = code):
+                self.run_md_compiler(
+                    markdown = r'''
+                        # Heading
+
+                        Paragraph1
+                        ''',
+                    build = fr'''
+                        import lamarkdown as la
+                        {code}
+                        la.css_files("cssfile.css")
+                        la.js_files("jsfile.js")
+                        ''',
+                    build_defaults = False
+                )
 
-            # Assert that the <link rel="stylesheet" href="..."> element exists.
-            assert_that(
-                self.root.xpath('count(/html/head/link[@rel="stylesheet"][@href="cssfile.css"])'),
-                is_(1))
+                # Assert that the <link rel="stylesheet" href="..."> element exists.
+                assert_that(
+                    XPATH_STYLESHEET_LINK_COUNT(self.root, href = 'cssfile.css'),
+                    is_(1))
 
-            # Assert that the <script src="..."> element exists, and that it comes after <p>.
-            assert_that(
-                self.root.xpath('count(/html/body/p/following-sibling::script[@src="jsfile.js"])'),
-                is_(1))
+                # Assert that the <script src="..."> element exists, and that it comes after <p>.
+                assert_that(
+                    XPATH_SCRIPT_AFTER_P_COUNT(self.root, src = 'jsfile.js'),
+                    is_(1))
 
 
     def test_css_js_files_embedded(self):
@@ -419,30 +480,31 @@ class MdCompilerTestCase(unittest.TestCase):
             'la.embed(lambda mime, **k: mime in ["text/css", "application/javascript"])',
             'la.embed(lambda tag,  **k: tag in ["style", "script"])'
         ]:
-            self.run_md_compiler(
-                markdown = r'''
-                    # Heading
-
-                    Paragraph1
-                    ''',
-                build = fr'''
-                    import lamarkdown as la
-                    {code}
-                    la.css_files("cssfile.css")
-                    la.js_files("jsfile.js")
-                    ''',
-                build_defaults = False
-            )
+            with self.subTest(code = code):
+                self.run_md_compiler(
+                    markdown = r'''
+                        # Heading
+
+                        Paragraph1
+                        ''',
+                    build = fr'''
+                        import lamarkdown as la
+                        {code}
+                        la.css_files("cssfile.css")
+                        la.js_files("jsfile.js")
+                        ''',
+                    build_defaults = False
+                )
 
-            # Assert that the <style>...</style> element exists, with the right content.
-            assert_that(
-                self.root.xpath('/html/head/style/text()'),
-                only_contains(equal_to_ignoring_whitespace('p{color:blue}')))
+                # Assert that the <style>...</style> element exists, with the right content.
+                assert_that(
+                    XPATH_STYLE_TEXT(self.root),
+                    only_contains(equal_to_ignoring_whitespace('p{color:blue}')))
 
-            # Assert that the <script>...</script> element exists, with the right content.
-            assert_that(
-                self.root.xpath('/html/body/script/text()'),
-                only_contains(equal_to_ignoring_whitespace('console.log(1)')))
+                # Assert that the <script>...</script> element exists, with the right content.
+                assert_that(
+                    XPATH_SCRIPT_TEXT(self.root),
+                    only_contains(equal_to_ignoring_whitespace('console.log(1)')))
 
 
     def test_element_embedding(self):
@@ -461,37 +523,41 @@ class MdCompilerTestCase(unittest.TestCase):
         with open(os.path.join(self.tmp_dir, 'audio.wav'), 'wb') as f:
             f.write(wav_bytes)
 
+        gif_data_uri = f'data:image/gif;base64,{base64.b64encode(gif_bytes).decode()}'
+        wav_data_uri = f'data:audio/x-wav;base64,{base64.b64encode(wav_bytes).decode()}'
+
         for embed_spec in [
             'True',
             'lambda url,  **k: url and (url.endswith("gif") or url.endswith("wav"))',
             'lambda mime, **k: mime in ["image/gif", "audio/x-wav"]',
             'lambda tag,  **k: tag in ["img", "audio"]'
         ]:
-            self.run_md_compiler(
-                markdown = r'''
-                    # Heading
+            with self.subTest(embed_spec = embed_spec):
+                self.run_md_compiler(
+                    markdown = r'''
+                        # Heading
 
-                    ![Text](image.gif)
-                    <audio src="audio.wav" type="audio/x-wav" />
-                ''',
-                build = rf'''
-                    import lamarkdown as la
-                    la.embed({embed_spec})
-                ''',
+                        ![Text](image.gif)
+                        <audio src="audio.wav" type="audio/x-wav" />
+                    ''',
+                    build = rf'''
+                        import lamarkdown as la
+                        la.embed({embed_spec})
+                    ''',
 
-                # lxml/libxml complains about <audio> (and other HTML 5 tags) being invalid. I'm not
-                # sure whether/how it can be pursuaded to accept them, other than by turning on
-                # 'recovery' of (supposedly) broken HTML.
-                recover = True
-            )
+                    # lxml/libxml complains about <audio> (and other HTML 5 tags) being invalid.
+                    # I'm not sure whether/how it can be pursuaded to accept them, other than by
+                    # turning on 'recovery' of (supposedly) broken HTML.
+                    recover = True
+                )
 
-            assert_that(
-                self.root.xpath('//img/@src'),
-                only_contains(f'data:image/gif;base64,{base64.b64encode(gif_bytes).decode()}'))
+                assert_that(
+                    XPATH_IMG_SRC(self.root),
+                    only_contains(gif_data_uri))
 
-            assert_that(
-                self.root.xpath('//audio/@src'),
-                only_contains(f'data:audio/x-wav;base64,{base64.b64encode(wav_bytes).decode()}'))
+                assert_that(
+                    XPATH_AUDIO_SRC(self.root),
+                    only_contains(wav_data_uri))
 
 
     @patch('lamarkdown.lib.resources.read_url')
@@ -504,31 +570,32 @@ class MdCompilerTestCase(unittest.TestCase):
             'lambda mime, **k: mime not in ["image/gif", "audio/x-wav"]',
             'lambda tag,  **k: tag not in ["img", "audio"]'
         ]:
-            self.run_md_compiler(
-                markdown = r'''
-                    # Heading
+            with self.subTest(embed_spec = embed_spec):
+                self.run_md_compiler(
+                    markdown = r'''
+                        # Heading
 
-                    ![Text](image.gif)
-                    <audio src="audio.wav" type="audio/x-wav" />
-                ''',
-                build = rf'''
-                    import lamarkdown as la
-                    la.embed({embed_spec})
-                ''',
+                        ![Text](image.gif)
+                        <audio src="audio.wav" type="audio/x-wav" />
+                    ''',
+                    build = rf'''
+                        import lamarkdown as la
+                        la.embed({embed_spec})
+                    ''',
 
-                # lxml/libxml complains about <audio> (and other HTML 5 tags) being invalid. I'm not
-                # sure whether/how it can be pursuaded to accept them, other than by turning on
-                # 'recovery' of (supposedly) broken HTML.
-                recover = True
-            )
+                    # lxml/libxml complains about <audio> (and other HTML 5 tags) being invalid.
+                    # I'm not sure whether/how it can be pursuaded to accept them, other than by
+                    # turning on 'recovery' of (supposedly) broken HTML.
+                    recover = True
+                )
 
-            assert_that(
-                self.root.xpath('//img/@src'),
-                only_contains('image.gif'))
+                assert_that(
+                    XPATH_IMG_SRC(self.root),
+                    only_contains('image.gif'))
 
-            assert_that(
-                self.root.xpath('//audio/@src'),
-                only_contains('audio.wav'))
+                assert_that(
+                    XPATH_AUDIO_SRC(self.root),
+                    only_contains('audio.wav'))
 
 
     @patch('lamarkdown.lib.resources.read_url')
@@ -556,20 +623,20 @@ class MdCompilerTestCase(unittest.TestCase):
             )
 
             # <{tag} id="a">: scale by 2
-            assert_that(self.root.xpath(f'//{tag}[@id="a"]/@width'),  contains_exactly('20'))
-            assert_that(self.root.xpath(f'//{tag}[@id="a"]/@height'), contains_exactly('30'))
+            assert_that(XPATH_WIDTH(self.root, tag = tag, id = 'a'),  contains_exactly('20'))
+            assert_that(XPATH_HEIGHT(self.root, tag = tag, id = 'a'), contains_exactly('30'))
 
             # <{tag} id="b">: scale by 3
-            assert_that(self.root.xpath(f'//{tag}[@id="b"]/@width'),  contains_exactly('30'))
-            assert_that(self.root.xpath(f'//{tag}[@id="b"]/@height'), contains_exactly('45'))
+            assert_that(XPATH_WIDTH(self.root, tag = tag, id = 'b'),  contains_exactly('30'))
+            assert_that(XPATH_HEIGHT(self.root, tag = tag, id = 'b'), contains_exactly('45'))
 
             # <{tag} id="c">: scale by 2*5
-            assert_that(self.root.xpath(f'//{tag}[@id="c"]/@width'),  contains_exactly('100'))
-            assert_that(self.root.xpath(f'//{tag}[@id="c"]/@height'), contains_exactly('150'))
+            assert_that(XPATH_WIDTH(self.root, tag = tag, id = 'c'),  contains_exactly('100'))
+            assert_that(XPATH_HEIGHT(self.root, tag = tag, id = 'c'), contains_exactly('150'))
 
             # <{tag} id="d">: scale by 3*5
-            assert_that(self.root.xpath(f'//{tag}[@id="d"]/@width'),  contains_exactly('150'))
-            assert_that(self.root.xpath(f'//{tag}[@id="d"]/@height'), contains_exactly('225'))
+            assert_that(XPATH_WIDTH(self.root, tag = tag, id = 'd'),  contains_exactly('150'))
+            assert_that(XPATH_HEIGHT(self.root, tag = tag, id = 'd'), contains_exactly('225'))
 
 
     def test_disentangle_svgs(self):
@@ -632,14 +699,11 @@ class MdCompilerTestCase(unittest.TestCase):
         )
 
         def for_(f):
-            self.set_results(
-                os.path.join(self.tmp_dir, f + '.html'),
-                lxml.html.HTMLParser(recover = False, no_network = True)
-            )
+            self.set_results(os.path.join(self.tmp_dir, f + '.html'), self.html_parsers[False])
 
         def exists():
             assert_that(
-                self.root.xpath('/html/body/h1/text()'), contains_exactly('Heading'))
+                [h1.text for h1 in self.root.findall('body/h1')], contains_exactly('Heading'))
 
         # Check variant A, which should have the default name.
         exists()
@@ -662,13 +726,13 @@ class MdCompilerTestCase(unittest.TestCase):
 
         # Check variant E, which should be missing its 'p' elements:
         for_('testdoc_variant_e')
-        assert_that(self.root.xpath('/html/body/h1'), not_(empty()))
-        assert_that(self.root.xpath('/html/body/p'),  is_(empty()))
+        assert_that(self.root.findall('body/h1'), not_(empty()))
+        assert_that(self.root.findall('body/p'),  is_(empty()))
 
         # Check variant F, which should be missing its 'h1' element:
         for_('testdoc_variant_f')
-        assert_that(self.root.xpath('/html/body/h1'), is_(empty()))
-        assert_that(self.root.xpath('/html/body/p'),  not_(empty()))
+        assert_that(self.root.findall('body/h1'), is_(empty()))
+        assert_that(self.root.findall('body/p'),  not_(empty()))
 
 
     def test_tree_hooks(self):
@@ -709,11 +773,11 @@ class MdCompilerTestCase(unittest.TestCase):
         )
 
         assert_that(
-            self.root.xpath('//h1/text()'),
+            XPATH_H1_TEXT(self.root),
             contains_exactly('Heading1 h1', 'Heading2 h1'))
 
         assert_that(
-            self.root.xpath('//p/text()'),
+            XPATH_P_TEXT(self.root),
             contains_exactly('Paragraph1 p', 'Paragraph2 p'))
 
         assert_that(
@@ -761,15 +825,7 @@ class MdCompilerTestCase(unittest.TestCase):
         # Check the document structure.
         assert_that(
             self.body_html,
-            matches_regexp(
-                r'''(?x)
-                \s* <body>
-                \s* <h1[ ]id="testid"> Heading </h1>
-                \s* <p> Paragraph \s* <abbr[ ]title="description"> PARA </abbr> </p>
-                \s* </body>
-                \s*
-                '''
-            )
+            matches_regexp(EXTENSIONS_BODY_REGEX)
         )
 
 
@@ -791,15 +847,7 @@ class MdCompilerTestCase(unittest.TestCase):
 
         assert_that(
             self.body_html,
-            matches_regexp(
-                r'''(?x)
-                \s* <body>
-                \s* <h1> Heading... </h1>
-                \s* <p> "Paragraph" [ ] (&mdash;|—) [ ] (&laquo;|«) Text (&raquo;|») </p>
-                \s* </body>
-                \s*
-                '''
-            )
+            matches_regexp(EXTENSION_CONFIG_BODY_REGEX)
         )
 
 
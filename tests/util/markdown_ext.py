@@ -1,12 +1,45 @@
 from __future__ import annotations
 # from hamcrest import assert_that, matches_regexp
 import markdown
+import functools
 import importlib
 import re
 import sys
+from textwrap import dedent
 from xml.etree import ElementTree
 
 
+@functools.lru_cache(maxsize = None)
+def dedent_strip(text: str) -> str:
+    '''
+    Dedents and strips a block of test input. Test cases often convert the same (constant) input
+    repeatedly, so we only do the work once for each one.
+    '''
+    return dedent(text).strip()
+
+
+def config_key(*args, **kwargs):
+    '''
+    Returns a hashable representation of a set of Markdown configuration arguments, suitable for
+    looking up a previously-constructed Markdown instance. Plain lists and dicts are converted to
+    tuples and frozensets. If any other values are unhashable (and so probably mutable), this
+    returns None, since the corresponding Markdown instance can't be safely reused. (This includes
+    dict subclasses like MockCache, which tests may inspect or modify.)
+    '''
+    def freeze(value):
+        if type(value) in (list, tuple):
+            return tuple(freeze(v) for v in value)
+        if type(value) is dict:
+            return frozenset((k, freeze(v)) for k, v in value.items())
+        hash(value)
+        return value
+
+    try:
+        return freeze((args, kwargs))
+    except TypeError:
+        return None
+
+
 def entry_point_cls(name: str) -> tuple[str, str]:
 
     if sys.version_info >= (3, 10):
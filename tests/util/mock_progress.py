@@ -26,6 +26,9 @@ class MockMsg:
 class MockProgress:
     def __init__(self, expect_error: bool = False):
         self._expect_error = expect_error
+        self.reset()
+
+    def reset(self):
         self.progress_messages = []
         self.cache_messages = []
         self.warning_messages = []